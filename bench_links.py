@@ -0,0 +1,89 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+# Microbenchmark for sync_reporty_wiki.transform_obsidian_links: times the single pass transformer against the
+# original chain of re.sub/str.replace calls over a synthetic vault and checks that both give identical output.
+#
+#   python bench_links.py --notes 5000
+
+os.environ.setdefault("OBSIDIAN_VAULT_PATH", tempfile.gettempdir())
+os.environ.setdefault("GITHUB_WIKI_PATH", tempfile.gettempdir())
+
+import sync_reporty_wiki as sync
+
+
+def legacy_transform_obsidian_links(content):
+    # the transformer as it was before the single pass version, kept here as the reference
+    content = re.sub(r'!\[\[(.*?)\]\]', lambda m: f'![{m.group(1).split("|")[0]}](./{sync.slugify(m.group(1).split("|")[0]).replace(sync.FILE_NAME_FILTER_WORD_OUT, "")})', content)
+    content = re.sub(r'\[\[(.*?)\]\]', lambda m: f'[{m.group(1).split("|")[0]}](./{sync.slugify(m.group(1).split("|")[0]).replace("FILE_NAME_FILTER_WORD_OUT", "")})', content)
+    if "-png" in content:
+        content = content.replace("-png", ".png")
+    if "-svg" in content:
+        content = content.replace("-svg", ".svg")
+    if "-jpg" in content:
+        content = content.replace("-jpg", ".jpg")
+    if "-jpeg" in content:
+        content = content.replace("-jpeg", ".jpeg")
+    if "-pdf" in content:
+        content = content.replace("-pdf", ".pdf")
+    content = re.sub(r'# Excalidraw Data.*', '', content, flags=re.DOTALL)
+    return content
+
+
+def make_note(rng, titles):
+    lines = ["---", "type: sync-docs", "tags: [reporty]", "---", ""]
+    for _ in range(rng.randint(20, 120)):
+        roll = rng.random()
+        if roll < 0.25:
+            lines.append(f"See [[{rng.choice(titles)}]], [[{rng.choice(titles)}|an alias]] and [[{rng.choice(titles)}#Some Heading]].")
+        elif roll < 0.35:
+            lines.append(f"![[diagram {rng.randint(0, 500)}.png]] ![[scan-{rng.randint(0, 500)}.pdf]] ![[photo {rng.randint(0, 50)}.jpg|300]]")
+        elif roll < 0.4:
+            lines.append("software-setup notes for the x-png exporter, see-pdf and -svg output")
+        else:
+            lines.append("lorem ipsum dolor sit amet, consectetur adipiscing elit " * rng.randint(1, 6))
+    if rng.random() < 0.2:
+        lines += ["# Excalidraw Data", "## Text Elements", "```json", json.dumps({"elements": ["x" * 80] * 200}), "```"]
+    return "\n".join(lines)
+
+
+def time_transform(transform, notes):
+    start = time.perf_counter()
+    outputs = [transform(note) for note in notes]
+    return time.perf_counter() - start, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark transform_obsidian_links against the original implementation.")
+    parser.add_argument('--notes', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    titles = [f"Topic {i} Notes" for i in range(args.notes // 4 + 1)]
+    notes = [make_note(rng, titles) for _ in range(args.notes)]
+
+    sync.render_link.cache_clear()
+    legacy_seconds, legacy_outputs = time_transform(legacy_transform_obsidian_links, notes)
+    new_seconds, new_outputs = time_transform(sync.transform_obsidian_links, notes)
+    mismatches = sum(1 for old, new in zip(legacy_outputs, new_outputs) if old != new)
+
+    print(json.dumps({
+        "notes": args.notes,
+        "megabytes": round(sum(len(note) for note in notes) / 1e6, 2),
+        "legacy_seconds": round(legacy_seconds, 3),
+        "single_pass_seconds": round(new_seconds, 3),
+        "speedup": round(legacy_seconds / new_seconds, 2) if new_seconds else None,
+        "mismatches": mismatches,
+    }, indent=4))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
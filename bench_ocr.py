@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fitz  # PyMuPDF
+
+# Benchmarks the OCR pipeline in process_pdfs.py against a local stub of the chat completions endpoint,
+# so no API key is needed and every run sees the same simulated latency.
+#
+#   python bench_ocr.py --pages 40 --latency 0.5 --max-in-flight 8
+#   python bench_ocr.py --encode-matrix --bandwidth 2000000   # compare upload preprocessing settings
+#   python bench_ocr.py --fail-rate 0.2   # inject 429/503s, dropped connections, truncated and malformed bodies
+#   python bench_ocr.py --triage-check   # framed, slide and table pages must convert locally, handwriting must not
+
+
+class StubCompletionsHandler(BaseHTTPRequestHandler):
+    latency = 0.5  # seconds the stub "thinks" before answering each request
+    bandwidth = 0  # simulated upload bytes per second, 0 = unlimited
+    fail_rate = 0  # share of requests answered with a fault instead of a completion
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        time.sleep(self.latency + (length / self.bandwidth if self.bandwidth else 0))
+        self.server.request_count += 1
+
+        if random.random() < self.fail_rate:
+            self.server.fault_count += 1
+            self.send_fault(random.choice(['429', '503', 'drop', 'truncated', 'malformed']))
+            return
+
+        body = json.dumps({
+            "choices": [{"message": {"content": f"# Page\n\nstub text {random.random()}\n"}}],
+            "usage": {"prompt_tokens": len(json.dumps(payload)) // 4, "completion_tokens": 12},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_fault(self, fault):
+        if fault == 'drop':
+            self.close_connection = True
+            self.connection.close()
+            return
+        if fault == 'truncated':
+            # promise a longer body than is sent, then hang up mid-body
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '4096')
+            self.end_headers()
+            self.wfile.write(b'{"choices": [{"message": {"content": "')
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.close()
+            return
+        if fault == 'malformed':
+            body = b'{"choices": ['
+            self.send_response(200)
+        else:
+            body = b'{"error": {"message": "injected fault"}}'
+            self.send_response(int(fault))
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency, bandwidth=0, fail_rate=0):
+    handler = type('Handler', (StubCompletionsHandler,),
+                   {'latency': latency, 'bandwidth': bandwidth, 'fail_rate': fail_rate,
+                    'protocol_version': 'HTTP/1.1'})  # keep-alive, like the real endpoint
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.request_count = 0
+    server.fault_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions"
+
+
+def make_synthetic_pdf(path, pages, scanned=True):
+    # scanned pages carry only a rendered image, so they go to the API instead of the local text layer path
+    doc = fitz.open()
+    for i in range(pages):
+        source = fitz.open()
+        page = source.new_page()
+        page.insert_text((72, 72), f"Synthetic page {i + 1}", fontsize=24)
+        for line in range(40):
+            page.insert_text((72, 110 + line * 16), f"line {line} " + "lorem ipsum dolor sit amet " * 3, fontsize=10)
+        if scanned:
+            target = doc.new_page(width=page.rect.width, height=page.rect.height)
+            target.insert_image(target.rect, pixmap=page.get_pixmap(dpi=150))
+        else:
+            doc.insert_pdf(source)
+        source.close()
+    doc.save(path)
+    doc.close()
+
+
+def make_triage_pages():
+    # pages with a full text layer and only decorations convert locally, handwritten pages go to the API
+    doc = fitz.open()
+
+    def text_page(lines=30):
+        page = doc.new_page()
+        for line in range(lines):
+            page.insert_text((72, 80 + line * 16), f"line {line} " + "lorem ipsum dolor sit amet " * 3, fontsize=10)
+        return page
+
+    page = text_page()
+    page.draw_rect(page.rect + (20, 20, -20, -20), width=0.5)
+    yield 'framed', True, page
+    page = text_page()
+    frame = page.rect + (20, 20, -20, -20)
+    for start, end in ((frame.tl, frame.tr), (frame.tr, frame.br), (frame.br, frame.bl), (frame.bl, frame.tl)):
+        page.draw_line(start, end, width=0.5)
+    yield 'framed with lines', True, page
+    page = doc.new_page()
+    page.draw_rect(page.rect, color=None, fill=(0.93, 0.93, 0.93))
+    for line in range(30):
+        page.insert_text((72, 80 + line * 16), f"slide bullet {line} " + "lorem ipsum dolor " * 3, fontsize=10)
+    yield 'slide background', True, page
+    page = text_page()
+    for y in range(68, 560, 16):
+        page.draw_line((66, y), (520, y), width=0.5)
+    for x in (66, 300, 520):
+        page.draw_line((x, 68), (x, 548), width=0.5)
+    yield 'ruled table', True, page
+    page = text_page(lines=4)
+    rng = random.Random(0)
+    for row in range(24):
+        x, y = 60, 160 + row * 25
+        while x < 530:
+            points = [(x, y)]
+            for _ in range(12):
+                x += rng.uniform(1, 3)
+                points.append((x, y + rng.uniform(-8, 8)))
+            page.draw_polyline(points, width=1.2)
+            x += rng.uniform(6, 14)
+    yield 'handwritten', False, page
+
+
+def triage_check(process_pdfs):
+    results = []
+    for label, expect_local, page in make_triage_pages():
+        local = process_pdfs.native_page_markdown(page) is not None
+        results.append({"page": label, "drawing_coverage": round(process_pdfs.drawing_coverage(page), 3),
+                        "local": local, "ok": local == expect_local})
+    return results
+
+
+def run_ocr(process_pdfs, pdf_path, static_png_path, max_workers):
+    start = time.perf_counter()
+    process_pdfs.ocr_and_extract_text(pdf_path, static_png_path, max_workers=max_workers)
+    return time.perf_counter() - start
+
+
+def encode_matrix(process_pdfs, pdf_path, static_png_path, max_in_flight):
+    # bytes per page, encode time and end to end latency for a range of upload preprocessing settings
+    defaults = process_pdfs.image_settings
+    matrix = [
+        ('png color full size (old behaviour)', defaults._replace(mode='color', max_dimension=0, format='png')),
+        ('png auto full size (default)', defaults._replace(mode='auto', max_dimension=0, format='png')),
+        ('png grayscale 2048', defaults._replace(mode='grayscale', max_dimension=2048, format='png')),
+        ('png bilevel 2048', defaults._replace(mode='bilevel', max_dimension=2048, format='png')),
+        ('jpeg grayscale 2048 q85', defaults._replace(mode='grayscale', max_dimension=2048, format='jpeg', quality=85)),
+        ('webp grayscale 2048 q80', defaults._replace(mode='grayscale', max_dimension=2048, format='webp', quality=80)),
+        ('jpeg grayscale 150dpi 1536 q75', defaults._replace(dpi=150, mode='grayscale', max_dimension=1536, format='jpeg', quality=75)),
+    ]
+    results = []
+    for label, settings in matrix:
+        images = [image for _, image, _ in process_pdfs.iter_pages(pdf_path, dpi=settings.dpi, use_text_layer=False)]
+        start = time.perf_counter()
+        encoded = [process_pdfs.encode_image(image, settings) for image in images]
+        encode_seconds = time.perf_counter() - start
+        del images
+
+        process_pdfs.image_settings = settings
+        end_to_end = run_ocr(process_pdfs, pdf_path, static_png_path, max_workers=max_in_flight)
+        results.append({
+            "setting": label,
+            "bytes_per_page": sum(len(data) for data in encoded) // len(encoded),
+            "encode_ms_per_page": round(encode_seconds * 1000 / len(encoded), 1),
+            "end_to_end_seconds": round(end_to_end, 3),
+        })
+    process_pdfs.image_settings = defaults
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs concurrent OCR benchmark against a local stub server.")
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.5, help="simulated seconds per API request")
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--rate-limit', type=float, default=0)
+    parser.add_argument('--bandwidth', type=float, default=0, help="simulated upload bytes per second (0 = unlimited)")
+    parser.add_argument('--fail-rate', type=float, default=0,
+                        help="share of requests the stub answers with a 429/503, a dropped connection, a body cut short "
+                             "or a malformed body")
+    parser.add_argument('--encode-matrix', action='store_true',
+                        help="compare upload preprocessing settings instead of serial vs concurrent")
+    parser.add_argument('--triage-check', action='store_true',
+                        help="check which kinds of text layer pages are converted locally, exits 1 on a wrong call")
+    args = parser.parse_args()
+
+    if args.triage_check:
+        import process_pdfs
+        results = triage_check(process_pdfs)
+        print(json.dumps(results, indent=4))
+        return 0 if all(result["ok"] for result in results) else 1
+
+    server, url = start_stub_server(args.latency, args.bandwidth, args.fail_rate)
+    os.environ['OPENAI_API_URL'] = url
+    import process_pdfs
+    process_pdfs.OPENAI_API_URL = url
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, 'bench.pdf')
+        make_synthetic_pdf(pdf_path, args.pages)
+        static_png_path = os.path.join(tmp, 'bench')
+
+        if args.encode_matrix:
+            process_pdfs.configure_api_limits(args.max_in_flight, args.rate_limit)
+            results = encode_matrix(process_pdfs, pdf_path, static_png_path, args.max_in_flight)
+            server.shutdown()
+            print(json.dumps(results, indent=4))
+            return 0
+
+        process_pdfs.configure_api_limits(1, args.rate_limit)
+        serial = run_ocr(process_pdfs, pdf_path, static_png_path, max_workers=1)
+
+        process_pdfs.configure_api_limits(args.max_in_flight, args.rate_limit)
+        concurrent = run_ocr(process_pdfs, pdf_path, static_png_path, max_workers=args.max_in_flight)
+
+    server.shutdown()
+    print(json.dumps({
+        "pages": args.pages,
+        "latency": args.latency,
+        "max_in_flight": args.max_in_flight,
+        "serial_seconds": round(serial, 3),
+        "concurrent_seconds": round(concurrent, 3),
+        "speedup": round(serial / concurrent, 2) if concurrent else None,
+        "requests": server.request_count,
+        "injected_faults": server.fault_count,
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
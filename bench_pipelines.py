@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+# End to end benchmark of both scripts on generated data: a synthetic Obsidian vault for sync_reporty_wiki.main
+# and a synthetic PDF corpus for process_pdfs.process_pdfs_in_folder (against the bench_ocr.py stub server).
+# Every run happens in a fresh subprocess so peak RSS and I/O counts belong to that run alone, and each scale
+# is run cold (empty output) and warm (nothing changed since the cold run).
+#
+#   python bench_pipelines.py --scales small medium
+#   python bench_pipelines.py --scales large --workers 4 --output bench_history.jsonl   # appends one line per run
+
+# scale -> (notes in the vault, PDFs, pages per PDF)
+SCALES = {
+    'small': (200, 4, 3),
+    'medium': (2000, 12, 5),
+    'large': (10000, 30, 8),
+}
+
+FRONTMATTERS = [
+    "---\ntype: sync-docs\ntags: [reporty, docs]\n---\n",  # selected by the tags list
+    "---\ntype: sync-docs\ntag: reporty\n---\n",  # selected by a plain value
+    "---\ntype: sync-docs\ntags: [other]\n---\n",  # right type, wrong tags
+    "---\ntype: meeting\ntags: [reporty]\n---\n",  # right tags, wrong type
+    "---\ntitle: no type\n---\n",
+    "",  # no frontmatter at all
+]
+ASSET_EXTENSIONS = ['png', 'jpg', 'svg', 'pdf']
+
+
+def make_vault(path, notes, seed=0):
+    # write a vault of notes with a mix of frontmatter, links, embeds and Excalidraw sections, plus static assets
+    rng = random.Random(seed)
+    titles = [f"Topic {i} Notes" for i in range(notes)]
+    assets = [f"static/{'diagrams/' if i % 3 else ''}asset {i}.{ASSET_EXTENSIONS[i % len(ASSET_EXTENSIONS)]}"
+              for i in range(max(10, notes // 5))]
+    for asset in assets:
+        asset_path = os.path.join(path, asset)
+        os.makedirs(os.path.dirname(asset_path), exist_ok=True)
+        with open(asset_path, 'wb') as f:
+            f.write(rng.randbytes(rng.randint(2_000, 200_000)))
+
+    for i, title in enumerate(titles):
+        folder = os.path.join(path, f"area {i % 7}", f"project {i % 23}") if i % 4 else path
+        os.makedirs(folder, exist_ok=True)
+        lines = [rng.choice(FRONTMATTERS)]
+        for _ in range(rng.randint(10, 120)):
+            roll = rng.random()
+            if roll < 0.2:
+                lines.append(f"See [[{rng.choice(titles)}]], [[{rng.choice(titles)}|an alias]] "
+                             f"and [[{rng.choice(titles)}#Some Heading]].")
+            elif roll < 0.28:
+                asset = os.path.basename(rng.choice(assets))
+                lines.append(f"![[{asset}]] ![[{os.path.basename(rng.choice(assets))}|300]]")
+            elif roll < 0.3:
+                lines.append(f"Broken [[Missing Note {rng.randint(0, 50)}]] and software-setup-png notes")
+            else:
+                lines.append("lorem ipsum dolor sit amet, consectetur adipiscing elit " * rng.randint(1, 6))
+        if rng.random() < 0.15:
+            lines += ["# Excalidraw Data", "## Text Elements", "```json",
+                      json.dumps({"elements": ["x" * 80] * rng.randint(50, 500)}), "```"]
+        with open(os.path.join(folder, f"{title}.md"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+
+
+def make_pdf_corpus(path, pdfs, pages):
+    # write PDFs named after the yaml_mappings keys, alternating scanned pages and pages with a text layer
+    from bench_ocr import make_synthetic_pdf
+    prefixes = ['korean', 'reporty', 'personal', 'dreams', 'misc']
+    for i in range(pdfs):
+        folder = os.path.join(path, f"notebook {i % 3}")
+        os.makedirs(folder, exist_ok=True)
+        make_synthetic_pdf(os.path.join(folder, f"{prefixes[i % len(prefixes)]} {i}.pdf"), pages, scanned=i % 2 == 0)
+
+
+def io_counters():
+    # Linux only: rchar/wchar count every read/write, read_bytes/write_bytes what actually hit the block device
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f if ': ' in line)}
+    except OSError:
+        return {}
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(run):
+    from run_metrics import metrics
+    io_before = io_counters()
+    cpu_before = cpu_seconds()
+    start = time.perf_counter()
+    run()
+    wall = time.perf_counter() - start
+    io_after = io_counters()
+    return {
+        'wall_seconds': round(wall, 3),
+        'cpu_seconds': round(cpu_seconds() - cpu_before, 3),
+        # peak of the whole process (imports included) and of any worker processes
+        'max_rss_kb': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                          resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+        'io': {key: io_after[key] - io_before.get(key, 0) for key in io_after},
+        'counters': metrics.report()['counters'],
+    }
+
+
+def child_sync(args):
+    os.environ['OBSIDIAN_VAULT_PATH'] = args.vault
+    os.environ['GITHUB_WIKI_PATH'] = args.wiki
+    os.makedirs(args.wiki, exist_ok=True)
+    import sync_reporty_wiki
+    sys.argv = ['sync_reporty_wiki.py', '--workers', str(args.workers), '--asset-mode', args.asset_mode, '--report', '']
+    return measure(sync_reporty_wiki.main)
+
+
+def child_pdfs(args):
+    from bench_ocr import start_stub_server
+    server, url = start_stub_server(args.latency)
+    import process_pdfs
+    process_pdfs.OPENAI_API_URL = url
+    process_pdfs.configure_api_limits(args.max_in_flight, 0)
+    static_path = os.path.join(args.vault, 'static')
+    os.makedirs(os.path.join(args.vault, 'knowledge'), exist_ok=True)
+    os.makedirs(static_path, exist_ok=True)
+    result = measure(lambda: process_pdfs.process_pdfs_in_folder(
+        args.pdfs, args.vault, static_path, os.path.join(args.state, 'pdf_state.sqlite'),
+        pdf_workers=args.workers, vault_index_path=os.path.join(args.state, 'vault_index.json')))
+    server.shutdown()
+    return result
+
+
+def run_child(kind, log_dir, *child_args):
+    env = dict(os.environ, LOG_DIR=log_dir)
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', kind, *child_args],
+                          env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise RuntimeError(f"{kind} benchmark run failed with exit code {proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def bench_scale(scale, args, tmp):
+    notes, pdfs, pages = SCALES[scale]
+    root = os.path.join(tmp, scale)
+    vault, wiki, pdf_dir, log_dir = (os.path.join(root, name) for name in ('vault', 'wiki', 'pdfs', 'logs'))
+    os.makedirs(log_dir)
+
+    start = time.perf_counter()
+    make_vault(vault, notes, seed=args.seed)
+    make_pdf_corpus(pdf_dir, pdfs, pages)
+    generate_seconds = time.perf_counter() - start
+
+    results = {'scale': scale, 'notes': notes, 'pdfs': pdfs, 'pages_per_pdf': pages,
+               'generate_seconds': round(generate_seconds, 3)}
+    sync_args = ['--vault', vault, '--wiki', wiki, '--workers', str(args.workers), '--asset-mode', args.asset_mode]
+    results['sync_cold'] = run_child('sync', log_dir, *sync_args)
+    results['sync_warm'] = run_child('sync', log_dir, *sync_args)
+
+    # the OCR vault is separate from the sync vault, so the scan cost of both is measured on its own
+    pdf_args = ['--pdfs', pdf_dir, '--vault', os.path.join(root, 'ocr_vault'), '--state', log_dir,
+                '--workers', str(args.pdf_workers), '--latency', str(args.latency),
+                '--max-in-flight', str(args.max_in_flight)]
+    results['pdfs_cold'] = run_child('pdfs', log_dir, *pdf_args)
+    results['pdfs_warm'] = run_child('pdfs', log_dir, *pdf_args)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark both pipelines on synthetic vaults and PDFs.")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'])
+    parser.add_argument('--workers', type=int, default=1, help="sync --workers")
+    parser.add_argument('--asset-mode', choices=['copy', 'reflink', 'hardlink'], default='copy', help="sync --asset-mode")
+    parser.add_argument('--pdf-workers', type=int, default=2)
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated seconds per API request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="append the results as one JSON line to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the generated data and print where it is")
+    # used internally to run one measurement in a fresh process
+    parser.add_argument('--child', choices=['sync', 'pdfs'], help=argparse.SUPPRESS)
+    parser.add_argument('--vault', help=argparse.SUPPRESS)
+    parser.add_argument('--wiki', help=argparse.SUPPRESS)
+    parser.add_argument('--pdfs', help=argparse.SUPPRESS)
+    parser.add_argument('--state', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        result = child_sync(args) if args.child == 'sync' else child_pdfs(args)
+        print(json.dumps(result))
+        return 0
+
+    tmp = tempfile.mkdtemp(prefix='bench_pipelines_')
+    run = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'settings': {key: getattr(args, key)
+                     for key in ('workers', 'asset_mode', 'pdf_workers', 'max_in_flight', 'latency', 'seed')},
+        'results': [bench_scale(scale, args, tmp) for scale in args.scales],
+    }
+    if args.keep:
+        print(f"generated data kept in {tmp}", file=sys.stderr)
+    else:
+        shutil.rmtree(tmp)
+
+    print(json.dumps(run, indent=4))
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,35 @@
 import os
-import subprocess
 import fitz  # PyMuPDF
 import openai
-from pdf2image import convert_from_path
 from PIL import Image
 import io
 import base64
 import requests
+from requests.adapters import HTTPAdapter
+import random
 import shutil
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import logging
 import re
+import argparse
+import hashlib
+import sqlite3
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from run_metrics import metrics, profiled
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # not on Linux, --inotify falls back to polling
+    INotify = None
 
 # Set up logging to print to the console and to a file
-LOG_FILE_PATH = '/app/logs/process_pdfs.log'
+LOG_DIR = os.getenv('LOG_DIR', '/app/logs')
+LOG_FILE_PATH = os.path.join(LOG_DIR, 'process_pdfs.log')
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
     logging.FileHandler(LOG_FILE_PATH),
     logging.StreamHandler()
@@ -24,9 +39,58 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 GOOGLE_DRIVE_PATH = '/app/pdfs'
 OBSIDIAN_BASE_PATH = '/app/obsidian'  # OBSIDIAN_VOLUME_PATH --> "user/path/to/where/files/are:/app/obsidian"  - keep the "/app/obsidian" part the same in dockerfile env def
 OBSIDIAN_STATIC_PATH = os.path.join(OBSIDIAN_BASE_PATH, 'knowledge', 'static')  # this will change by your path OBSIDIAN_BASE_PATH file structure 
-ROBOCOPY_LOG = '/app/logs/robocopy_log.txt'
-SYNC_SUMMARY_LOG = '/app/logs/sync_summary_log.txt'
-JSON_LOG_PATH = '/app/logs/pdf_processing_log.json'
+ROBOCOPY_LOG = os.path.join(LOG_DIR, 'robocopy_log.txt')
+SYNC_SUMMARY_LOG = os.path.join(LOG_DIR, 'sync_summary_log.txt')
+JSON_LOG_PATH = os.path.join(LOG_DIR, 'pdf_processing_log.json')  # legacy log, imported into the state store once
+OCR_CACHE_PATH = os.path.join(LOG_DIR, 'ocr_cache.sqlite')
+VAULT_INDEX_PATH = os.path.join(LOG_DIR, 'vault_index.json')
+RUN_REPORT_PATH = os.path.join(LOG_DIR, 'process_pdfs_report.json')  # timings and counters of the last run
+STATE_DB_PATH = os.path.join(LOG_DIR, 'pdf_state.sqlite')  # per PDF and per page processing state, replaces JSON_LOG_PATH
+OCR_CACHE_MAX_BYTES = int(os.getenv('OCR_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))  # LRU eviction above this size
+
+# OpenAI endpoint and model (the url can be pointed at a local stub server for benchmarking)
+OPENAI_API_URL = os.getenv('OPENAI_API_URL', 'https://api.openai.com/v1/chat/completions')
+OCR_MODEL = 'gpt-4o'
+OCR_CONNECT_TIMEOUT = float(os.getenv('OCR_CONNECT_TIMEOUT', '10'))
+OCR_READ_TIMEOUT = float(os.getenv('OCR_READ_TIMEOUT', '120'))
+OCR_MAX_RETRIES = int(os.getenv('OCR_MAX_RETRIES', '5'))  # retries per request after 429, 5xx, timeouts and malformed responses
+OCR_BACKOFF_SECONDS = float(os.getenv('OCR_BACKOFF_SECONDS', '1'))  # first retry delay, doubled on every attempt
+OCR_BACKOFF_MAX_SECONDS = float(os.getenv('OCR_BACKOFF_MAX_SECONDS', '60'))  # caps our own delay, a server's Retry-After is always honoured
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Concurrency limits, can also be set with the matching command line flags
+OCR_MAX_IN_FLIGHT = int(os.getenv('OCR_MAX_IN_FLIGHT', '4'))  # max API requests in flight across all PDFs
+OCR_REQUESTS_PER_SECOND = float(os.getenv('OCR_REQUESTS_PER_SECOND', '0'))  # 0 = no rate limiting
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '2'))  # number of PDFs processed at the same time
+WATCH_DEBOUNCE_SECONDS = float(os.getenv('WATCH_DEBOUNCE_SECONDS', '5'))  # a PDF must stop changing this long before it is processed
+WATCH_POLL_SECONDS = float(os.getenv('WATCH_POLL_SECONDS', '2'))
+
+# How pages are rendered and prepared for upload. The PNGs saved next to the note are always full quality,
+# only the copy sent to the API is converted/downscaled/compressed.
+ImageSettings = namedtuple('ImageSettings', ['dpi', 'mode', 'max_dimension', 'format', 'quality'])
+image_settings = ImageSettings(
+    dpi=int(os.getenv('RASTER_DPI', '200')),  # page render resolution (200 is the old pdf2image default)
+    mode=os.getenv('IMAGE_MODE', 'auto').lower(),  # color, grayscale, bilevel, or auto (grayscale unless the page has color)
+    max_dimension=int(os.getenv('IMAGE_MAX_DIMENSION', '0')),  # longest side, 0 = no limit (resampled text compresses worse as png)
+    format=os.getenv('IMAGE_FORMAT', 'png').lower(),  # png, jpeg or webp
+    quality=int(os.getenv('IMAGE_QUALITY', '85')),  # jpeg/webp quality
+)
+IMAGE_MODES = ['auto', 'color', 'grayscale', 'bilevel']
+IMAGE_MIME_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'webp': 'image/webp'}
+GRAYSCALE_SATURATION = 12  # mean HSV saturation (0-255) below which an 'auto' page is treated as grayscale
+BILEVEL_THRESHOLD = 160
+
+# Pages with a real text layer are converted locally instead of being sent to the API
+NATIVE_TEXT_MIN_CHARS = int(os.getenv('NATIVE_TEXT_MIN_CHARS', '200'))  # fewer characters than this means a scan
+NATIVE_TEXT_MAX_IMAGE_COVERAGE = float(os.getenv('NATIVE_TEXT_MAX_IMAGE_COVERAGE', '0.3'))  # share of the page covered by images
+# share of the page covered by vector drawings with no text of their own (handwriting from Onyx exports, diagrams)
+NATIVE_TEXT_MAX_DRAWING_COVERAGE = float(os.getenv('NATIVE_TEXT_MAX_DRAWING_COVERAGE', '0.15'))
+USE_TEXT_LAYER = os.getenv('USE_TEXT_LAYER', '1') != '0'  # --always-ocr turns this off
+BULLETS = ('•', '◦', '▪', '‣', '●', '–', '-', '*')
+
+# The "GPT instructions" pass runs once per document, over chunks of about this many characters
+# (each chunk is rewritten in one response, so it has to fit in the response's max_tokens)
+SECOND_PASS_CHUNK_CHARS = int(os.getenv('SECOND_PASS_CHUNK_CHARS', '3000'))
 
 
 ### GPT instructions
@@ -60,96 +124,651 @@ yaml_mappings = {
 # Set up OpenAI API key from environment variable
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-def encode_image(image):
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-    return f"data:image/png;base64,{img_str}"
+def is_grayscale(image):
+    sample = image.convert('RGB')
+    sample.thumbnail((256, 256))
+    saturation = sample.convert('HSV').getchannel('S')
+    return sum(saturation.getdata()) / (sample.width * sample.height) < GRAYSCALE_SATURATION
 
-def convert_from_path_and_save(pdf_path, filename, static_png_path):
-    images = convert_from_path(pdf_path)
-    img_file_paths = []
-    for i, image in enumerate(images):
-        img_path = f"{static_png_path}_{i}.png"
-        image.save(img_path, 'PNG')
-        img_file_paths.append(f"{img_path}")
-    return images, img_file_paths
+def preprocess_image(image, settings):
+    if settings.max_dimension and max(image.size) > settings.max_dimension:
+        scale = settings.max_dimension / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+
+    mode = settings.mode
+    if mode == 'auto':
+        mode = 'grayscale' if is_grayscale(image) else 'color'
+    if mode == 'grayscale':
+        image = image.convert('L')
+    elif mode == 'bilevel':
+        image = image.convert('L').point(lambda value: 255 if value > BILEVEL_THRESHOLD else 0, mode='1')
+    return image
+
+def encode_image(image, settings=None):
+    settings = settings or image_settings
+    with metrics.span('encode'):
+        image = preprocess_image(image, settings)
+        image_format = 'jpeg' if settings.format == 'jpg' else settings.format
+
+        buffered = io.BytesIO()
+        if image_format == 'png':
+            image.save(buffered, format="PNG", optimize=image.mode == '1')
+        else:
+            # jpeg/webp have no 1-bit mode
+            if image.mode == '1':
+                image = image.convert('L')
+            image.save(buffered, format=image_format.upper(), quality=settings.quality)
+        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    metrics.count('bytes_uploaded', len(img_str))
+    return f"data:{IMAGE_MIME_TYPES[image_format]};base64,{img_str}"
+
+# MuPDF is not thread safe, so rendering from several PDF workers is serialized through this lock
+fitz_lock = threading.Lock()
+
+def text_dict_to_markdown(page_dict):
+    # markdown from PyMuPDF's get_text('dict') output, headings are guessed from the font size
+    sizes = Counter()
+    for block in page_dict['blocks']:
+        for line in block.get('lines', []):
+            for span in line['spans']:
+                sizes[round(span['size'])] += len(span['text'].strip())
+    body_size = sizes.most_common(1)[0][0] if sizes else 0
+
+    paragraphs = []
+    for block in page_dict['blocks']:
+        lines = []
+        for line in block.get('lines', []):
+            text = "".join(span['text'] for span in line['spans']).strip()
+            if text:
+                lines.append((text, max(span['size'] for span in line['spans'])))
+        if not lines:
+            continue
+
+        size = max(line_size for _, line_size in lines)
+        if any(text.startswith(BULLETS) for text, _ in lines):
+            items = []
+            for text, _ in lines:
+                if text.startswith(BULLETS) or not items:
+                    items.append(text.lstrip("".join(BULLETS)).strip())
+                else:
+                    items[-1] += f" {text}"
+            paragraphs.append("\n".join(f"- {item}" for item in items))
+            continue
+
+        text = " ".join(text for text, _ in lines)
+        if body_size and size >= body_size * 1.6:
+            paragraphs.append(f"# {text}")
+        elif body_size and size >= body_size * 1.25:
+            paragraphs.append(f"## {text}")
+        else:
+            paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+def union_area(rects):
+    # area covered by a list of rects, overlaps counted once
+    xs = sorted({x for rect in rects for x in (rect.x0, rect.x1)})
+    area = 0.0
+    for left, right in zip(xs, xs[1:]):
+        # merge the y intervals of the rects spanning this vertical strip
+        spans = sorted((rect.y0, rect.y1) for rect in rects if rect.x0 <= left and rect.x1 >= right)
+        covered, top, bottom = 0.0, None, None
+        for y0, y1 in spans:
+            if bottom is None or y0 > bottom:
+                if bottom is not None:
+                    covered += bottom - top
+                top, bottom = y0, y1
+            else:
+                bottom = max(bottom, y1)
+        if bottom is not None:
+            covered += bottom - top
+        area += (right - left) * covered
+    return area
+
+def is_decoration(drawing, page_rect):
+    # page borders and frames are unfilled rectangles, white fills are invisible on paper, and slide and
+    # page backgrounds fill (nearly) the whole page
+    if drawing['type'] == 's' and all(item[0] in ('re', 'qu') for item in drawing['items']):
+        return True
+    if drawing.get('fill') is None:
+        return False
+    return (drawing.get('color') is None and tuple(drawing['fill']) == (1.0, 1.0, 1.0)
+            or (drawing['rect'] & page_rect).get_area() >= 0.9 * page_rect.get_area())
+
+def drawing_coverage(page):
+    # share of the page covered by vector drawings that have no text layer of their own
+    drawings = [d for d in page.get_drawings() if not is_decoration(d, page.rect)]
+    if not drawings:
+        return 0.0
+    # table rules, underlines and boxes around text group with the text they frame, handwriting and
+    # diagrams are strokes with no text spans under them
+    words = [fitz.Rect(word[:4]) for word in page.get_text('words')]
+    rects = [rect & page.rect for rect in page.cluster_drawings(drawings=drawings)]
+    rects = [rect for rect in rects if not rect.is_empty and not any(rect.intersects(word) for word in words)]
+    return union_area(rects) / page.rect.get_area()
+
+def native_page_markdown(page):
+    # markdown from the page's own text layer, or None when the page is a scan, mostly images or drawn
+    if len(page.get_text().strip()) < NATIVE_TEXT_MIN_CHARS:
+        return None
+    page_area = page.rect.get_area()
+    image_area = sum(fitz.Rect(info['bbox']).intersect(page.rect).get_area() for info in page.get_image_info())
+    if not page_area or image_area / page_area > NATIVE_TEXT_MAX_IMAGE_COVERAGE:
+        return None
+    # handwriting and diagrams are vector paths with no text layer, they would be dropped from the note
+    if drawing_coverage(page) > NATIVE_TEXT_MAX_DRAWING_COVERAGE:
+        return None
+    return text_dict_to_markdown(page.get_text('dict'))
+
+def iter_pages(pdf_path, dpi=None, use_text_layer=True):
+    # render and yield the pages one at a time as (index, image, markdown from the text layer or None)
+    dpi = dpi or image_settings.dpi
+    with fitz_lock:
+        doc = fitz.open(pdf_path)
+    try:
+        for i in range(doc.page_count):
+            with fitz_lock:
+                page = doc[i]
+                with metrics.span('text_layer'):
+                    markdown = native_page_markdown(page) if use_text_layer else None
+                with metrics.span('rasterize'):
+                    pix = page.get_pixmap(dpi=dpi)
+                    image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                del pix, page
+            yield i, image, markdown
+    finally:
+        with fitz_lock:
+            doc.close()
 
 # def replace_brackets(text):
 
 #     # Replace words encased in "[]" with "[[]]"
 #     return re.sub(r'\[(.*?)\]', r'[[\1]]', text)
 
-def ocr_and_extract_text(pdf_path, static_png_path):
-    filename = os.path.splitext(os.path.basename(pdf_path))[0]
-    yaml_properties = get_yaml_properties(filename)
+class RateLimiter:
+    # spaces API request starts at least 1/rate seconds apart, shared by all worker threads
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
 
-    # Convert PDF pages to images
-    images, img_file_paths = convert_from_path_and_save(pdf_path, filename, static_png_path)
-    text = ""
-    for image in images:
-        base64_image = encode_image(image)
-
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {openai.api_key}"
-        }
-
-        payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": api_instructions.format(yaml_properties=yaml_properties),
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": base64_image
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 1000
-        }
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            slot = max(time.monotonic(), self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
 
-        response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-        response_json = response.json()
+def make_api_session(pool_size):
+    # one keep-alive connection per request slot, so concurrent pages reuse TLS connections instead of reconnecting
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
-        try:
-            text += response_json['choices'][0]['message']['content']
-        except KeyError as e:
-            logging.info(f'{response_json}')
-            raise e
-        
-        # Check if there are any instructions to follow
-        if "gpt" in text.lower():
-            context = text
-            payload = {
-                "model": "gpt-4o",
-                "messages": [
+api_slots = threading.BoundedSemaphore(OCR_MAX_IN_FLIGHT)
+rate_limiter = RateLimiter(OCR_REQUESTS_PER_SECOND)
+api_session = make_api_session(OCR_MAX_IN_FLIGHT)
+
+def configure_api_limits(max_in_flight, requests_per_second):
+    global OCR_MAX_IN_FLIGHT, api_slots, rate_limiter, api_session
+    OCR_MAX_IN_FLIGHT = max(1, max_in_flight)
+    api_slots = threading.BoundedSemaphore(OCR_MAX_IN_FLIGHT)
+    rate_limiter = RateLimiter(requests_per_second)
+    api_session.close()
+    api_session = make_api_session(OCR_MAX_IN_FLIGHT)
+
+class OcrError(Exception):
+    # the API could not answer a request, even after retrying
+    pass
+
+class OcrCache:
+    # persistent LRU cache of API responses, keyed by a digest of the request payload (page image, prompt, model)
+    def __init__(self, path, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(payload):
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.count('ocr_cache_misses')
+                return None
+            self.hits += 1
+            metrics.count('ocr_cache_hits')
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, content):
+        size = len(content.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logging.info(f"Evicted {len(evicted)} entries from the OCR cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# opened by main(), None disables caching
+ocr_cache = None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def ocr_settings_fingerprint(content_hash):
+    # page texts are only reused while the PDF and everything that shapes the OCR request stay the same
+    return hashlib.sha256(json.dumps(
+        [content_hash, OCR_MODEL, image_settings, api_instructions, USE_TEXT_LAYER, NATIVE_TEXT_MIN_CHARS,
+         NATIVE_TEXT_MAX_IMAGE_COVERAGE, NATIVE_TEXT_MAX_DRAWING_COVERAGE]
+    ).encode('utf-8')).hexdigest()
+
+class StateStore:
+    # processing state of every PDF and page in SQLite, keyed by full path and committed after each document
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY, content_hash TEXT, mtime REAL, size INTEGER, fingerprint TEXT,
+                status TEXT NOT NULL, markdown_path TEXT, pages INTEGER, started REAL, finished REAL,
+                seconds REAL, prompt_tokens INTEGER, completion_tokens INTEGER, error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                path TEXT NOT NULL, page INTEGER NOT NULL, status TEXT NOT NULL, text TEXT, seconds REAL,
+                prompt_tokens INTEGER, completion_tokens INTEGER, PRIMARY KEY (path, page)
+            );
+        """)
+        self._conn.commit()
+
+    def is_up_to_date(self, pdf_path, mtime, size):
+        # true if pdf_path was processed before and its content hasn't changed since
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, mtime, size FROM documents WHERE path = ? AND status = 'done'", (pdf_path,)
+            ).fetchone()
+        if row is None:
+            return False
+        content_hash, done_mtime, done_size = row
+        if (done_mtime, done_size) == (mtime, size):
+            return True
+        if done_size != size or content_hash is None:
+            return False
+        # touched but maybe not changed (copied back, synced again, ...), only then is the file hashed
+        if file_sha256(pdf_path) != content_hash:
+            return False
+        with self._lock:
+            self._conn.execute("UPDATE documents SET mtime = ? WHERE path = ?", (mtime, pdf_path))
+            self._conn.commit()
+        return True
+
+    def start_document(self, pdf_path, markdown_path, content_hash, mtime, size):
+        fingerprint = ocr_settings_fingerprint(content_hash)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, status, prompt_tokens, completion_tokens FROM documents WHERE path = ?", (pdf_path,)
+            ).fetchone()
+            if row is None or row[0] != fingerprint:
+                self._conn.execute("DELETE FROM pages WHERE path = ?", (pdf_path,))
+            # tokens spent by earlier failed attempts still count towards this document
+            spent = (row[2] or 0, row[3] or 0) if row and row[0] == fingerprint and row[1] != 'done' else (0, 0)
+            resumed = self._conn.execute(
+                "SELECT COUNT(*) FROM pages WHERE path = ? AND text IS NOT NULL", (pdf_path,)
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (path, content_hash, mtime, size, fingerprint, status, "
+                "markdown_path, started, prompt_tokens, completion_tokens) VALUES (?, ?, ?, ?, ?, 'processing', ?, ?, ?, ?)",
+                (pdf_path, content_hash, mtime, size, fingerprint, markdown_path, time.time(), *spent)
+            )
+            self._conn.commit()
+        if resumed:
+            logging.info(f"Resuming {pdf_path}, {resumed} pages were already answered")
+
+    def page_text(self, pdf_path, page):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM pages WHERE path = ? AND page = ? AND status = 'ocr'", (pdf_path, page)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record_page(self, pdf_path, page, status, text, seconds, usage):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (path, page, status, text, seconds, prompt_tokens, completion_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (pdf_path, page, status, text, seconds, usage['prompt_tokens'], usage['completion_tokens'])
+            )
+            self._conn.commit()
+
+    def finish_document(self, pdf_path, seconds, usage, error=None):
+        with self._lock:
+            pages = self._conn.execute("SELECT COUNT(*) FROM pages WHERE path = ?", (pdf_path,)).fetchone()[0]
+            self._conn.execute(
+                "UPDATE documents SET status = ?, pages = ?, finished = ?, seconds = ?, "
+                "prompt_tokens = prompt_tokens + ?, completion_tokens = completion_tokens + ?, error = ? WHERE path = ?",
+                ('failed' if error else 'done', pages, time.time(), seconds, usage['prompt_tokens'],
+                 usage['completion_tokens'], error, pdf_path)
+            )
+            if not error:
+                # the note has the text now, the rows keep only the statistics
+                self._conn.execute("UPDATE pages SET text = NULL WHERE path = ?", (pdf_path,))
+            self._conn.commit()
+
+    def import_json_log(self, json_log_path, pdf_files):
+        # mark PDFs the old JSON log (base filename -> mtime) recorded as processed, then retire that log
+        if not os.path.exists(json_log_path):
+            return
+        log_data = load_json_log(json_log_path)
+        imported = 0
+        with self._lock:
+            for pdf_path, (mtime, size) in pdf_files.items():
+                base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+                if base_filename in log_data and mtime <= log_data[base_filename]:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO documents (path, content_hash, mtime, size, status) "
+                        "VALUES (?, ?, ?, ?, 'done')",
+                        (pdf_path, file_sha256(pdf_path), mtime, size)
+                    )
+                    imported += 1
+            self._conn.commit()
+        os.replace(json_log_path, json_log_path + ".migrated")
+        logging.info(f"Imported {imported} processed PDFs from {json_log_path}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def retry_after_seconds(response):
+    # delay asked for by a Retry-After header (seconds or an HTTP date), None if there is none
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_seconds(attempt, response=None):
+    delay = retry_after_seconds(response)
+    if delay is None:
+        # full jitter, so pages that failed together don't all retry at the same moment
+        delay = random.uniform(0, min(OCR_BACKOFF_MAX_SECONDS, OCR_BACKOFF_SECONDS * 2 ** attempt))
+    return delay
+
+def post_completion(payload):
+    # POST payload to the completions endpoint, retrying with backoff, and return the content and token usage
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {openai.api_key}"
+    }
+    for attempt in range(OCR_MAX_RETRIES + 1):
+        response = None
+        # the semaphore bounds in-flight requests across every PDF being processed, it is not held while backing off
+        with api_slots:
+            rate_limiter.wait()
+            metrics.count('api_requests')
+            try:
+                with metrics.span('api_request'):
+                    response = api_session.post(OPENAI_API_URL, headers=headers, json=payload,
+                                                timeout=(OCR_CONNECT_TIMEOUT, OCR_READ_TIMEOUT))
+                if response.status_code in RETRY_STATUS_CODES:
+                    error = f"HTTP {response.status_code}"
+                elif response.status_code >= 400:
+                    raise OcrError(f"HTTP {response.status_code}: {response.text[:500]}")
+                else:
+                    response_json = response.json()
+                    content = response_json['choices'][0]['message']['content']
+                    usage = response_json.get('usage') or {}
+                    metrics.count('prompt_tokens', usage.get('prompt_tokens', 0))
+                    metrics.count('completion_tokens', usage.get('completion_tokens', 0))
+                    return content, usage
+            except (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                    requests.exceptions.InvalidSchema, requests.exceptions.InvalidHeader) as e:
+                # a configuration problem, retrying cannot help
+                raise OcrError(f"{type(e).__name__}: {e}") from e
+            except (ValueError, KeyError, IndexError, TypeError):
+                error = f"malformed response: {response.text[:500]}"
+            except requests.RequestException as e:
+                # dropped connections, bodies cut short (ChunkedEncodingError), timeouts, ...
+                error = f"{type(e).__name__}: {e}"
+
+        if attempt == OCR_MAX_RETRIES:
+            raise OcrError(f"giving up after {attempt + 1} attempts, last error: {error}")
+        metrics.count('api_retries')
+        delay = backoff_seconds(attempt, response)
+        logging.warning(f"OCR request failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+def complete(payload, usage=None):
+    # message content for payload, from the OCR cache if the request was answered before (tokens spent go to usage)
+    key = OcrCache.key(payload) if ocr_cache else None
+    if key:
+        content = ocr_cache.get(key)
+        if content is not None:
+            return content
+
+    content, response_usage = post_completion(payload)
+    if usage is not None:
+        usage['prompt_tokens'] += response_usage.get('prompt_tokens', 0)
+        usage['completion_tokens'] += response_usage.get('completion_tokens', 0)
+    if key:
+        ocr_cache.put(key, content)
+    return content
+
+def ocr_page(image, yaml_properties, usage=None):
+    base64_image = encode_image(image)
+
+    payload = {
+        "model": OCR_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": api_instructions.format(yaml_properties=yaml_properties),
+                    },
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": api_second_instructions.format(context=context),
-                            },
-                        ]
+                        "type": "image_url",
+                        "image_url": {
+                            "url": base64_image
+                        }
                     }
-                ],
-                "max_tokens": 1000
+                ]
+            }
+        ],
+        "max_tokens": 1000
+    }
+
+    return complete(payload, usage)
+
+def follow_gpt_instructions(context, usage=None):
+    payload = {
+        "model": OCR_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": api_second_instructions.format(context=context),
+                    },
+                ]
             }
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            response_json = response.json()
-            text = response_json['choices'][0]['message']['content']
+        ],
+        "max_tokens": 1000
+    }
+    return complete(payload, usage)
+
+def split_into_chunks(page_texts, max_chars):
+    # group page texts into chunks of at most max_chars, splitting pages that are too long on paragraphs
+    pieces = []
+    for page_text in page_texts:
+        if len(page_text) <= max_chars:
+            pieces.append(page_text)
+            continue
+        for paragraph in re.split(r'(?<=\n\n)', page_text):
+            pieces.extend(paragraph[start:start + max_chars] for start in range(0, len(paragraph), max_chars))
+
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + len(piece) <= max_chars:
+            chunks[-1] += piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+def follow_document_instructions(page_texts, max_chars=None, usage=None):
+    # run the "GPT instructions" pass once per document, over chunks that each repeat the lines addressing GPT
+    text = "".join(page_texts)
+    if "gpt" not in text.lower():
+        return text
+
+    instructions = "\n".join(line for line in text.splitlines() if "gpt" in line.lower())
+    contexts = []
+    for chunk in split_into_chunks(page_texts, max_chars or SECOND_PASS_CHUNK_CHARS):
+        if "gpt" not in chunk.lower():
+            chunk = f"{instructions}\n\n{chunk}"
+        contexts.append(chunk)
+    if len(contexts) == 1:
+        return follow_gpt_instructions(contexts[0], usage)
+    chunk_usages = [Counter() for _ in contexts]
+    with ThreadPoolExecutor(max_workers=min(len(contexts), OCR_MAX_IN_FLIGHT)) as executor:
+        text = "\n\n".join(executor.map(follow_gpt_instructions, contexts, chunk_usages))
+    if usage is not None:
+        for chunk_usage in chunk_usages:
+            usage.update(chunk_usage)
+    return text
+
+def format_yaml_properties(properties):
+    lines = []
+    for key, value in properties.items():
+        if isinstance(value, list):
+            lines.append(f"{key}:")
+            lines.extend(f"  - {item}" for item in value)
+        else:
+            lines.append(f"{key}: {value}")
+    return "---\n" + "\n".join(lines) + "\n---\n"
+
+def ocr_and_extract_text(pdf_path, static_png_path, max_workers=None, use_text_layer=None, state=None, usage=None):
+    max_workers = max_workers or OCR_MAX_IN_FLIGHT
+    use_text_layer = USE_TEXT_LAYER if use_text_layer is None else use_text_layer
+    filename = os.path.splitext(os.path.basename(pdf_path))[0]
+    yaml_properties = get_yaml_properties(filename)
+
+    # Pages are rendered lazily and a page is only rendered once a worker slot is free, so at most
+    # max_workers page images are held in memory no matter how long the document is
+    pages = iter_pages(pdf_path, use_text_layer=use_text_layer)
+    window = threading.BoundedSemaphore(max_workers)
+    img_file_paths = []
+    futures = []
+    usage = Counter() if usage is None else usage
+    usage_lock = threading.Lock()
+    local_pages = 0
+
+    def save_ocr_and_release(i, image, img_path, markdown):
+        try:
+            start = time.perf_counter()
+            with metrics.span('save_png'):
+                image.save(img_path, 'PNG')
+            if markdown is None:
+                # pages answered before a failed run are picked up from the state store
+                text = state.page_text(pdf_path, i) if state else None
+                if text is not None:
+                    metrics.count('pages_resumed')
+                    return text
+                page_usage = Counter()
+                with metrics.span('ocr_page'):
+                    text = ocr_page(image, yaml_properties, page_usage)
+                status = 'ocr'
+                with usage_lock:
+                    usage.update(page_usage)
+            else:
+                # born-digital page, the API would add the front matter to the first page
+                if i == 0:
+                    markdown = format_yaml_properties(yaml_properties) + "\n" + markdown
+                text = markdown + "\n\n"
+                status = 'text_layer'
+                page_usage = Counter()
+            metrics.count(f'pages_{status}')
+            if state:
+                state.record_page(pdf_path, i, status, text, time.perf_counter() - start, page_usage)
+            return text
+        finally:
+            window.release()
+
+    # executor.submit keeps the futures in page order, so the texts are reassembled in order below
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            window.acquire()
+            page = next(pages, None)
+            if page is None:
+                window.release()
+                break
+            i, image, markdown = page
+            img_path = f"{static_png_path}_{i}.png"
+            img_file_paths.append(img_path)
+            local_pages += markdown is not None
+            futures.append(executor.submit(save_ocr_and_release, i, image, img_path, markdown))
+            del page, image
+    page_texts = [future.result() for future in futures]
+    logging.info(f"{pdf_path}: {local_pages} of {len(page_texts)} pages converted from the PDF text layer")
+
+    # Check if there are any instructions to follow
+    with metrics.span('second_pass'):
+        text = follow_document_instructions(page_texts, usage=usage)
 
     # text = replace_brackets(text)  # Replace single brackets with double brackets
-    logging.info(f"Extracted text: {text}")
+    logging.info(f"Extracted {len(text)} characters from {pdf_path}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Extracted text: {text}")
     return text, img_file_paths
 
 def get_yaml_properties(title):
@@ -164,22 +783,22 @@ def get_yaml_properties(title):
                         properties['tag'].append(v)
                 else:
                     properties[k] = v
-    # Remove duplicate tags
-    properties['tag'] = list(set(properties['tag']))
+    # Remove duplicate tags (sorted so the prompt, and with it the OCR cache key, is the same every run)
+    properties['tag'] = sorted(set(properties['tag']))
     return properties
 
 def create_markdown_note_in_obsidian(pdf_path, text, markdown_path, img_file_paths):
     logging.info(f"Creating Markdown note for {pdf_path}")
 
-    filename = os.path.splitext(os.path.basename(pdf_path))[0]  
     file_path_links = []
-    for i, img_path in enumerate(img_file_paths):
-        file_path_links.append(f"![[{filename}_{i}.png]]")  
+    for img_path in img_file_paths:
+        file_path_links.append(f"![[{os.path.basename(img_path)}]]")
 
-    with open(markdown_path, 'w', encoding='utf-8') as md_file:
+    with metrics.span('write_note'), open(markdown_path, 'w', encoding='utf-8') as md_file:
         md_file.write(text)
         md_file.write("\n\n")
         md_file.write(f"### **Original PDF (pngs):** \n {' '.join(file_path_links)} \n\n")
+        metrics.count('note_bytes_written', md_file.tell())
 
     logging.info(f"Markdown note created: {markdown_path}")
 
@@ -193,59 +812,378 @@ def save_json_log(json_log_path, log_data):
     with open(json_log_path, 'w') as log_file:
         json.dump(log_data, log_file, indent=4)
 
-def process_pdfs_in_folder(folder, vault_base_path, vault_static_path, json_log_path):
-    log_data = load_json_log(json_log_path)
-    existing_markdown_files = {}
-    for root, _, files in os.walk(vault_base_path):
-        # logging.info(f"Processing folder: {root}")
-        # logging.info(f"_: {_}")
-        # logging.info(f"files: {files}")
-        for filename in files:
-            if filename.endswith(".md"):
-                base_filename = os.path.splitext(filename)[0]
-                existing_markdown_files[base_filename] = os.path.join(root, filename)
-
-    for root, _, files in os.walk(folder):
-        for filename in files:
-            if filename.endswith(".pdf") and "books" not in root:
-                pdf_path = os.path.join(root, filename)
-                file_mod_time = os.path.getmtime(pdf_path)
-                base_filename = os.path.splitext(filename)[0]
-
-                # Check if the file has been modified since the last recorded time
-                if base_filename not in log_data or file_mod_time > log_data[base_filename]:
-                    logging.info(f"Processing {pdf_path}...")
+def process_pdf(pdf_path, markdown_path, vault_static_path, state=None):
+    # the PNGs are named after the note, which is unique even when PDFs in different folders share a name
+    base_filename = os.path.splitext(os.path.basename(markdown_path))[0]
+    static_png_path = os.path.join(vault_static_path, f"{base_filename}")
+
+    if state is None:
+        text, img_file_paths = ocr_and_extract_text(pdf_path, static_png_path)
+        create_markdown_note_in_obsidian(pdf_path, text, markdown_path, img_file_paths)
+        return
+
+    st = os.stat(pdf_path)
+    with metrics.span('hash_pdf'):
+        content_hash = file_sha256(pdf_path)
+    state.start_document(pdf_path, markdown_path, content_hash, st.st_mtime, st.st_size)
+    start = time.perf_counter()
+    usage = Counter()
+    try:
+        text, img_file_paths = ocr_and_extract_text(pdf_path, static_png_path, state=state, usage=usage)
+        create_markdown_note_in_obsidian(pdf_path, text, markdown_path, img_file_paths)
+    except Exception as e:
+        metrics.count('pdfs_failed')
+        state.finish_document(pdf_path, time.perf_counter() - start, usage, error=f"{type(e).__name__}: {e}")
+        raise
+    metrics.add_time('document', time.perf_counter() - start)
+    metrics.count('pdfs_processed')
+    state.finish_document(pdf_path, time.perf_counter() - start, usage)
+
+class DirectoryIndex:
+    # persistent listing of directory trees that only re-lists directories whose mtime changed
+    def __init__(self, path, refresh=False):
+        self.path = path
+        self.trees = load_json_log(path) if path and not refresh else {}
+        self.relisted = 0
+        self._dirty = False
+
+    def scan(self, root, suffix, stat_files=False, skip_dir=None):
+        # return {file_path: (mtime, size) or None} for the files under root ending with suffix
+        tree_key = f"{root}|{suffix}"
+        old_dirs = self.trees.get(tree_key, {})
+        new_dirs = {}
+        found = {}
+        stack = [root]
+        while stack:
+            dir_path = stack.pop()
+            if skip_dir and skip_dir(dir_path):
+                continue
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            entry = old_dirs.get(dir_path)
+            if entry is None or entry['mtime_ns'] != mtime_ns:
+                entry = self._list_dir(dir_path, mtime_ns, suffix)
+                self.relisted += 1
+                self._dirty = True
+            new_dirs[dir_path] = entry
+
+            stack.extend(os.path.join(dir_path, name) for name in entry['dirs'])
+            for name in entry['files']:
+                file_path = os.path.join(dir_path, name)
+                if stat_files:
                     try:
-                        if base_filename in existing_markdown_files:
-                            markdown_path = existing_markdown_files[base_filename]
-                            logging.info(f"Updating existing Markdown note: {markdown_path}")
-                        else:
-                            markdown_path = os.path.join(vault_base_path, "knowledge", f"{base_filename}.md")
-                            logging.info(f"Creating new Markdown note: {markdown_path}")
-                        
-                        static_pdf_path = os.path.join(vault_static_path, f"{base_filename}.pdf")
-                        static_png_path = os.path.join(vault_static_path, f"{base_filename}")
-
-                        text, img_file_paths = ocr_and_extract_text(pdf_path, static_png_path)
-                        create_markdown_note_in_obsidian(pdf_path, text, markdown_path, img_file_paths)
-                        
-                        # Update the log data with the new modification time
-                        log_data[base_filename] = file_mod_time
-                    except subprocess.CalledProcessError:
-                        logging.error(f"Failed to process {pdf_path}")
-
-    # Save the updated log data
-    save_json_log(json_log_path, log_data)
+                        st = os.stat(file_path)
+                    except FileNotFoundError:
+                        continue
+                    found[file_path] = (st.st_mtime, st.st_size)
+                else:
+                    found[file_path] = None
+
+        if new_dirs.keys() != old_dirs.keys():
+            self._dirty = True
+        self.trees[tree_key] = new_dirs
+        return found
+
+    @staticmethod
+    def _list_dir(dir_path, mtime_ns, suffix):
+        dirs, files = [], []
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    # like os.walk, symlinked directories are listed but not followed
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            dirs.append(entry.name)
+                    elif entry.name.endswith(suffix):
+                        files.append(entry.name)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            pass
+        return {'mtime_ns': mtime_ns, 'dirs': sorted(dirs), 'files': sorted(files)}
+
+    def save(self):
+        if self.path and self._dirty:
+            save_json_log(self.path, self.trees)
+            self._dirty = False
+
+def is_skipped_dir(dir_path):
+    return "books" in dir_path
+
+def note_name(pdf_path, folder, duplicates):
+    # notes.pdf in a/ and b/ become "notes (a)" and "notes (b)", so they don't overwrite each other's note and PNGs
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    parent = os.path.relpath(os.path.dirname(pdf_path), folder)
+    if name not in duplicates or parent == os.curdir:
+        return name
+    return f"{name} ({parent.replace(os.sep, ' - ')})"
+
+def process_pdfs_in_folder(folder, vault_base_path, vault_static_path, state_path, pdf_workers=None,
+                           vault_index_path=None, full_scan=False, only_paths=None, json_log_path=None):
+    pdf_workers = pdf_workers or PDF_WORKERS
+    state = StateStore(state_path)
 
+    # Without an index path (or with full_scan) every directory is re-listed, just like os.walk
+    index = DirectoryIndex(vault_index_path, refresh=full_scan)
+    existing_markdown_files = {}
+    with metrics.span('scan'):
+        for md_path in sorted(index.scan(vault_base_path, ".md")):
+            base_filename = os.path.splitext(os.path.basename(md_path))[0]
+            existing_markdown_files[base_filename] = md_path
+        pdf_files = index.scan(folder, ".pdf", stat_files=True, skip_dir=is_skipped_dir)
+
+    pending = []
+    logging.info(f"Scanned vault and PDF folder, {index.relisted} directories changed since the last run")
+    if json_log_path:
+        state.import_json_log(json_log_path, pdf_files)
+    # counted over the whole folder, so a watch mode batch names its PDFs the same way a full run does
+    names = Counter(os.path.splitext(os.path.basename(pdf_path))[0] for pdf_path in pdf_files)
+    duplicates = {name for name, count in names.items() if count > 1}
+    if only_paths is not None:
+        pdf_files = {pdf_path: stat for pdf_path, stat in pdf_files.items() if pdf_path in only_paths}
+    metrics.count('pdfs_scanned', len(pdf_files))
+    for pdf_path, (file_mod_time, file_size) in sorted(pdf_files.items()):
+        base_filename = note_name(pdf_path, folder, duplicates)
+
+        # Check if the file is new or its content changed since it was last processed
+        if not state.is_up_to_date(pdf_path, file_mod_time, file_size):
+            logging.info(f"Processing {pdf_path}...")
+            if base_filename != os.path.splitext(os.path.basename(pdf_path))[0]:
+                logging.warning(f"Other PDFs share the name of {pdf_path}, its note is named {base_filename}")
+            if base_filename in existing_markdown_files:
+                markdown_path = existing_markdown_files[base_filename]
+                logging.info(f"Updating existing Markdown note: {markdown_path}")
+            else:
+                markdown_path = os.path.join(vault_base_path, "knowledge", f"{base_filename}.md")
+                logging.info(f"Creating new Markdown note: {markdown_path}")
+            pending.append((pdf_path, markdown_path))
+    metrics.count('pdfs_skipped', len(pdf_files) - len(pending))
+
+    def run(job):
+        pdf_path, markdown_path = job
+        try:
+            # the state store records the document as done (or failed) as soon as it finishes
+            process_pdf(pdf_path, markdown_path, vault_static_path, state)
+        except OcrError as e:
+            # the pages answered so far are kept in the state store, the next run picks up from there
+            logging.error(f"Failed to process {pdf_path}: {e}")
+        except Exception:
+            # one bad PDF (corrupt file, full disk, ...) must not stop the rest of the batch
+            logging.exception(f"Failed to process {pdf_path}")
+
+    # Several PDFs run at once, their page requests share the global in-flight limit
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, pdf_workers)) as executor:
+            list(executor.map(run, pending))
+    finally:
+        state.close()
+    index.save()
+
+
+class PollingWatcher:
+    # reports PDFs under folder that appeared or changed since the previous poll
+    overflowed = False  # polling cannot miss changes, unlike InotifyWatcher
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index = DirectoryIndex(None)
+        self.seen = self._scan()
+
+    def _scan(self):
+        return self.index.scan(self.folder, ".pdf", stat_files=True, skip_dir=is_skipped_dir)
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        current = self._scan()
+        changed = {pdf_path for pdf_path, stat in current.items() if self.seen.get(pdf_path) != stat}
+        self.seen = current
+        return changed
+
+class InotifyWatcher:
+    # reports PDFs under folder that were written, moved in or created, using inotify
+    WATCH_FLAGS = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE
+                   | inotify_flags.DELETE_SELF) if INotify else 0
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.inotify = INotify()
+        self.watches = {}
+        self.overflowed = False  # set when the kernel dropped events, the caller has to rescan the folder
+        self._add_tree(folder)
+
+    def _add_tree(self, root):
+        # watch root and its subdirectories, returning the PDFs already inside them
+        found = set()
+        for dir_path, dirs, files in os.walk(root):
+            if is_skipped_dir(dir_path):
+                dirs[:] = []
+                continue
+            try:
+                self.watches[self.inotify.add_watch(dir_path, self.WATCH_FLAGS)] = dir_path
+            except OSError as e:
+                logging.warning(f"Cannot watch {dir_path}: {e}")
+            found.update(os.path.join(dir_path, name) for name in files if name.endswith(".pdf"))
+        return found
+
+    def poll(self, timeout):
+        changed = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            if event.mask & inotify_flags.Q_OVERFLOW:
+                # the event queue filled up (e.g. a burst from Drive sync), so changes and new directories
+                # may have been missed: watch the whole tree again and let the caller do a catch-up scan
+                logging.warning(f"inotify event queue overflowed, rescanning {self.folder}")
+                self.overflowed = True
+                self._add_tree(self.folder)
+                continue
+            dir_path = self.watches.get(event.wd)
+            if dir_path is None:
+                continue
+            if event.mask & inotify_flags.DELETE_SELF:
+                del self.watches[event.wd]
+                continue
+            path = os.path.join(dir_path, event.name)
+            if event.mask & inotify_flags.ISDIR:
+                if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                    changed |= self._add_tree(path)
+            elif event.name.endswith(".pdf"):
+                changed.add(path)
+        return changed
+
+def watch_folder(folder, vault_base_path, vault_static_path, state_path, pdf_workers=None,
+                 vault_index_path=None, use_inotify=False, json_log_path=None):
+    # process new or modified PDFs as they show up in folder, until interrupted
+    batches = queue.Queue()
+
+    def process_batches():
+        while True:
+            batch = batches.get()
+            try:
+                process_pdfs_in_folder(folder, vault_base_path, vault_static_path, state_path,
+                                       pdf_workers=pdf_workers, vault_index_path=vault_index_path,
+                                       only_paths=batch, json_log_path=json_log_path)
+            except Exception:
+                logging.exception(f"Failed to process {sorted(batch) if batch else 'PDF folder'}")
+            finally:
+                batches.task_done()
+
+    threading.Thread(target=process_batches, daemon=True).start()
+
+    # Catch up on whatever changed while the watcher was not running
+    batches.put(None)
+
+    # polling by default: bind mounts from Docker Desktop and network or Drive folders deliver no inotify
+    # events, so an inotify watcher there would silently never see a new PDF
+    if use_inotify and not INotify:
+        logging.warning("inotify_simple is not available, polling instead")
+    watcher = InotifyWatcher(folder) if use_inotify and INotify else PollingWatcher(folder)
+    logging.info(f"Watching {folder} for PDFs with {type(watcher).__name__}")
+
+    # pdf_path -> ((mtime, size), time of the last change), a file is handed over once it stops changing
+    settling = {}
+    while True:
+        now = time.monotonic()
+        for pdf_path in watcher.poll(WATCH_POLL_SECONDS):
+            settling[pdf_path] = (None, now)
+        if watcher.overflowed:
+            watcher.overflowed = False
+            batches.put(None)
+
+        now = time.monotonic()
+        ready = set()
+        for pdf_path, (last_stat, changed_at) in list(settling.items()):
+            try:
+                st = os.stat(pdf_path)
+            except FileNotFoundError:
+                del settling[pdf_path]
+                continue
+            stat = (st.st_mtime, st.st_size)
+            if stat != last_stat:
+                settling[pdf_path] = (stat, now)
+            elif now - changed_at >= WATCH_DEBOUNCE_SECONDS:
+                ready.add(pdf_path)
+                del settling[pdf_path]
+
+        if ready:
+            logging.info(f"Queueing {len(ready)} changed PDF(s): {sorted(ready)}")
+            batches.put(ready)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="OCR PDFs from Google Drive into Obsidian markdown notes.")
+    parser.add_argument('--max-in-flight', type=int, default=OCR_MAX_IN_FLIGHT,
+                        help="max OCR API requests in flight at once (1 = serial)")
+    parser.add_argument('--rate-limit', type=float, default=OCR_REQUESTS_PER_SECOND,
+                        help="max OCR API requests started per second (0 = unlimited)")
+    parser.add_argument('--pdf-workers', type=int, default=PDF_WORKERS,
+                        help="number of PDFs processed at the same time")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and process PDFs as they are added or modified")
+    parser.add_argument('--inotify', action='store_true',
+                        help="in watch mode, use inotify instead of polling (only for local Linux folders, "
+                             "Docker Desktop and network mounts deliver no events)")
+    parser.add_argument('--full-scan', action='store_true',
+                        help="re-list every directory instead of trusting the saved vault index")
+    parser.add_argument('--dpi', type=int, default=image_settings.dpi, help="page render resolution")
+    parser.add_argument('--image-mode', type=str.lower, choices=IMAGE_MODES, default=image_settings.mode,
+                        help="color conversion applied to pages before upload")
+    parser.add_argument('--image-max-dimension', type=int, default=image_settings.max_dimension,
+                        help="downscale uploaded pages so their longest side is at most this (0 = no limit)")
+    parser.add_argument('--image-format', type=str.lower, choices=list(IMAGE_MIME_TYPES), default=image_settings.format,
+                        help="format pages are uploaded in")
+    parser.add_argument('--image-quality', type=int, default=image_settings.quality, help="jpeg/webp quality")
+    parser.add_argument('--always-ocr', action='store_true',
+                        help="send every page to the API, even pages that already have a usable text layer")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always call the API instead of reusing cached responses for unchanged pages")
+    parser.add_argument('--report', default=RUN_REPORT_PATH,
+                        help="where to write the JSON run report with timings and counters")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="write cProfile stats of the run to PATH (view with python -m pstats PATH)")
+    args = parser.parse_args()
+    # argparse does not check defaults against choices, and the defaults come from the environment
+    if args.image_mode not in IMAGE_MODES:
+        parser.error(f"IMAGE_MODE must be one of {', '.join(IMAGE_MODES)}, not {args.image_mode!r}")
+    if args.image_format not in IMAGE_MIME_TYPES:
+        parser.error(f"IMAGE_FORMAT must be one of {', '.join(IMAGE_MIME_TYPES)}, not {args.image_format!r}")
+    return args
 
 def main():
-    # Perform OCR and create/update Markdown notes for PDFs in the Google Drive path
-    process_pdfs_in_folder(GOOGLE_DRIVE_PATH, OBSIDIAN_BASE_PATH, OBSIDIAN_STATIC_PATH, JSON_LOG_PATH)
-    
+    global ocr_cache, image_settings, USE_TEXT_LAYER
+    args = parse_args()
+    USE_TEXT_LAYER = USE_TEXT_LAYER and not args.always_ocr
+    configure_api_limits(args.max_in_flight, args.rate_limit)
+    image_settings = ImageSettings(args.dpi, args.image_mode, args.image_max_dimension, args.image_format,
+                                   args.image_quality)
+    if not args.no_cache:
+        ocr_cache = OcrCache(OCR_CACHE_PATH)
+
+    with profiled(args.profile):
+        if args.watch:
+            try:
+                watch_folder(GOOGLE_DRIVE_PATH, OBSIDIAN_BASE_PATH, OBSIDIAN_STATIC_PATH, STATE_DB_PATH,
+                             pdf_workers=args.pdf_workers, vault_index_path=VAULT_INDEX_PATH, use_inotify=args.inotify,
+                             json_log_path=JSON_LOG_PATH)
+            except KeyboardInterrupt:
+                logging.info("Stopped watching")
+        else:
+            # Perform OCR and create/update Markdown notes for PDFs in the Google Drive path
+            process_pdfs_in_folder(GOOGLE_DRIVE_PATH, OBSIDIAN_BASE_PATH, OBSIDIAN_STATIC_PATH, STATE_DB_PATH,
+                                   pdf_workers=args.pdf_workers, vault_index_path=VAULT_INDEX_PATH,
+                                   full_scan=args.full_scan, json_log_path=JSON_LOG_PATH)
+
+
     # Log the sync summary
     with open(SYNC_SUMMARY_LOG, 'a') as summary_log:
         summary_log.write(f"Sync summary logged on {datetime.now()}\n")
 
+    if ocr_cache:
+        logging.info(f"OCR cache: {ocr_cache.hits} hits, {ocr_cache.misses} misses")
+        ocr_cache.close()
+
+    if args.report:
+        report = metrics.write_report(args.report, script='process_pdfs', args=vars(args))
+        logging.info(f"Run report written to {args.report} ({report['wall_seconds']}s)")
+
 
 if __name__ == "__main__":
     main()
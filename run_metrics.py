@@ -0,0 +1,136 @@
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import resource
+except ImportError:  # Windows, the report has no CPU time or peak RSS there
+    resource = None
+
+# Timing spans and counters shared by process_pdfs.py and sync_reporty_wiki.py, written out as a JSON run report.
+#
+#   with metrics.span('encode'):
+#       ...
+#   metrics.count('bytes_uploaded', len(data))
+#
+# Span seconds are summed over every thread that ran the span, so with concurrency they can add up to more
+# than the wall time; compare them with each other, not with wall_seconds.
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.spans = {}  # name -> [count, seconds, max seconds]
+        self.counters = Counter()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, count=1):
+        with self._lock:
+            span = self.spans.setdefault(name, [0, 0.0, 0.0])
+            span[0] += count
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def drain(self):
+        # return everything recorded so far and start over, for shipping a worker process's metrics to the parent
+        with self._lock:
+            snapshot = {'spans': self.spans, 'counters': dict(self.counters)}
+            self.spans = {}
+            self.counters = Counter()
+        return snapshot
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, (count, seconds, max_seconds) in snapshot['spans'].items():
+                span = self.spans.setdefault(name, [0, 0.0, 0.0])
+                span[0] += count
+                span[1] += seconds
+                span[2] = max(span[2], max_seconds)
+            self.counters.update(snapshot['counters'])
+
+    def report(self, **extra):
+        with self._lock:
+            spans = {
+                name: {'count': count, 'seconds': round(seconds, 4), 'max_seconds': round(max_seconds, 4)}
+                for name, (count, seconds, max_seconds) in sorted(self.spans.items(), key=lambda item: -item[1][1])
+            }
+            counters = dict(sorted(self.counters.items()))
+        report = {
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'wall_seconds': round(time.perf_counter() - self._start, 4),
+        }
+        if resource:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            report['cpu_seconds'] = round(usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime, 4)
+            report['max_rss_kb'] = usage.ru_maxrss
+        return {
+            **report,
+            **extra,
+            'spans': spans,
+            'counters': counters,
+        }
+
+    def write_report(self, path, **extra):
+        report = self.report(**extra)
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=4)
+        return report
+
+
+# the running process's metrics
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(path):
+    # cProfile the block, including threads started inside it, and dump the combined stats to path
+    if not path:
+        yield
+        return
+
+    profiles = []
+    profiles_lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return  # Python 3.12+, where the main profiler already sees every thread
+        with profiles_lock:
+            profiles.append(profile)
+
+    main_profile = cProfile.Profile()
+    threading.setprofile(profile_thread)
+    main_profile.enable()
+    try:
+        yield
+    finally:
+        main_profile.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main_profile)
+        with profiles_lock:
+            for profile in profiles:
+                profile.create_stats()
+                stats.add(profile)
+        stats.dump_stats(path)
@@ -1,13 +1,25 @@
 import os
+import errno
 import shutil
+import hashlib
+import functools
 import yaml
 import re
 import json
 import pprint
 import logging
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from run_metrics import metrics, profiled
+try:
+    import fcntl
+except ImportError:  # not on Linux/macOS, reflinks are never attempted
+    fcntl = None
 
 # Set up logging to print to the console and to a file
-LOG_FILE_PATH = '/app/logs/sync_reporty_wiki.log'
+LOG_DIR = os.getenv('LOG_DIR', '/app/logs')
+LOG_FILE_PATH = os.path.join(LOG_DIR, 'sync_reporty_wiki.log')
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
     logging.FileHandler(LOG_FILE_PATH),
     logging.StreamHandler()
@@ -18,19 +30,83 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 OBSIDIAN_VAULT_PATH = os.getenv(f"OBSIDIAN_VAULT_PATH")
 GITHUB_WIKI_PATH = os.getenv("GITHUB_WIKI_PATH")
 MAPPING_FILE_PATH = os.path.join(GITHUB_WIKI_PATH, 'file_mapping.json')
+RUN_REPORT_PATH = os.path.join(LOG_DIR, 'sync_reporty_wiki_report.json')  # timings and counters of the last run
 FILE_NAME_FILTER_WORD_OUT = "software-"  # if your files have a naming pattern and you want to filter pattern out for unique names
 TARGET_TAGS = {'reporty'}  # add the tags or properties you want to check for
 TARGET_TYPE = 'sync-docs'  # a check if your markdown has some front matter you want to check for
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", "1"))  # worker processes/threads used by the export, 1 = serial
+FRONTMATTER_CHUNK_SIZE = 4096  # bytes read at a time while looking for the closing ---
+MANIFEST_VERSION = 3  # bump whenever the generated wiki output changes, so every note is exported again
 
+# How attachments are put into the wiki: copy (always a full copy), reflink (copy-on-write clone where the
+# filesystem supports it, e.g. btrfs or xfs, otherwise a copy) or hardlink (the wiki file is the vault file when
+# both are on the same filesystem, otherwise reflink/copy). Files whose size and mtime match are never touched.
+ASSET_MIRROR_MODE = os.getenv("ASSET_MIRROR_MODE", "reflink")
+ASSET_MIRROR_MODES = ('copy', 'reflink', 'hardlink')
+FICLONE = 0x40049409  # linux/fs.h, clone a whole file into another one
+
+# Everything transform_obsidian_links rewrites, matched in a single left to right pass:
+# ![[embeds]], [[links]], the "-png" style extension fixups and the start of the Excalidraw data.
+# Leading with the character class lets the regex engine skip plain text quickly.
+OBSIDIAN_TOKEN_RE = re.compile(
+    r'[-!\[#](?:(?<=!)\[\[(.*?)\]\]|(?<=\[)\[(.*?)\]\]|(?<=-)(png|svg|jpg|jpeg|pdf)|(?<=#) Excalidraw Data)'
+)
+EXCALIDRAW_MARKER = '# Excalidraw Data'
+
+
+def decode_markdown(data):
+    # same result as reading the file in text mode (utf-8, universal newlines)
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+class MarkdownFile:
+    # a vault note whose frontmatter is read on its own, read() then reads only the rest of the file
+    def __init__(self, path):
+        self.path = path
+        self._head = b""
+        self._complete = False  # True once _head holds the entire file
+        self._frontmatter = None
+
+    @property
+    def frontmatter(self):
+        if self._frontmatter is None:
+            self._frontmatter = self._read_frontmatter()
+        return self._frontmatter
+
+    def _read_chunk(self, f):
+        chunk = f.read(FRONTMATTER_CHUNK_SIZE)
+        self._head += chunk
+        if len(chunk) < FRONTMATTER_CHUNK_SIZE:
+            self._complete = True
+        return chunk
+
+    def _read_frontmatter(self):
+        with open(self.path, 'rb') as f:
+            self._read_chunk(f)
+            if not self._head.startswith(b'---'):
+                return {}
+            end = self._head.find(b'---', 3)
+            while end == -1 and not self._complete:
+                search_from = max(3, len(self._head) - 2)
+                self._read_chunk(f)
+                end = self._head.find(b'---', search_from)
+        if end == -1:
+            return {}
+        return yaml.safe_load(decode_markdown(self._head[3:end]))
+
+    def read(self):
+        # return the full content of the note, reusing whatever was read for the frontmatter
+        if self._complete:
+            data = self._head
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(len(self._head))
+                data = self._head + f.read()
+        self._head = b""
+        self._complete = False
+        return decode_markdown(data)
 
 def read_yaml_frontmatter(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-        frontmatter_match = re.match(r'^---(.*?)---', content, re.DOTALL)
-        if frontmatter_match:
-            frontmatter = frontmatter_match.group(1)
-            return yaml.safe_load(frontmatter)
-    return {}
+    return MarkdownFile(file_path).frontmatter
 
 def should_copy_file(frontmatter):
     if frontmatter.get('type') == TARGET_TYPE:
@@ -46,36 +122,110 @@ def should_copy_file(frontmatter):
             logging.error(f"Error checking frontmatter: {e}")
     return False
 
-def find_embedded_files(markdown_content):
-    embedded_files = re.findall(r'!\[\[(.*?)\]\]', markdown_content)  # Embedded files with ![[]]
-    embedded_files += re.findall(r'\[\[(.*?)\]\]', markdown_content)  # Links with [[]]
-    logging.info(f"Found embedded files and links: {embedded_files}")
-    embedded_files = [embedded_file.split(f"|")[0] for embedded_file in embedded_files]
-    return embedded_files
+def is_up_to_date(abs_path, dest_path):
+    # mirror_file keeps the source mtime, so a matching size and mtime means the file was already copied
+    try:
+        src_stat = os.stat(abs_path)
+        dest_stat = os.stat(dest_path)
+    except FileNotFoundError:
+        return False
+    return src_stat.st_size == dest_stat.st_size and src_stat.st_mtime_ns == dest_stat.st_mtime_ns
+
+def reflink(src_path, dest_path):
+    # clone src_path into a new file at dest_path, returns False if the filesystem cannot do it
+    if fcntl is None:
+        return False
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            return True
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM):
+                return False
+            raise
+
+def mirror_file(abs_path, dest_path, mode=None):
+    # put a copy of abs_path at dest_path the cheapest way mode allows, returns 'hardlink', 'reflink' or 'copy'
+    mode = mode or ASSET_MIRROR_MODE
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = dest_path + ".mirror-tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)  # left over from an interrupted run, may be a hard link to a vault file
+    try:
+        method = None
+        if mode == 'hardlink' and os.stat(abs_path).st_dev == os.stat(os.path.dirname(dest_path)).st_dev:
+            try:
+                os.link(abs_path, tmp_path)
+                method = 'hardlink'
+            except OSError:
+                pass  # e.g. a filesystem without hard links, or too many links to the file
+        if method is None and mode in ('reflink', 'hardlink') and reflink(abs_path, tmp_path):
+            method = 'reflink'
+        if method is None:
+            # copyfile copies in kernel space (sendfile) where it can and in chunks otherwise
+            shutil.copyfile(abs_path, tmp_path)
+            method = 'copy'
+        if method != 'hardlink':
+            shutil.copystat(abs_path, tmp_path)  # keep the mtime, is_up_to_date compares it
+        os.replace(tmp_path, dest_path)  # a hard linked destination is replaced, not written through to the vault
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return method
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def write_if_changed(dest_path, content, old_hash=None):
+    # write content to dest_path unless the file already holds it, returns (hash, written)
+    new_hash = content_hash(content)
+    if os.path.exists(dest_path):
+        if old_hash is None:
+            # no manifest entry yet, compare against what is on disk
+            with open(dest_path, 'r', encoding='utf-8', errors='replace') as f:
+                old_hash = content_hash(f.read())
+        if old_hash == new_hash:
+            return new_hash, False
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    with open(dest_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        metrics.count('bytes_written', f.tell())
+    return new_hash, True
 
 def copy_file(abs_path, vault_path, wiki_path, copied_files):
     if os.path.exists(abs_path) and abs_path not in copied_files:
         rel_path = os.path.relpath(abs_path, vault_path)
         slugified_filename = slugify(os.path.splitext(rel_path)[0]) + os.path.splitext(abs_path)[1]
         dest_path = os.path.join(wiki_path, slugified_filename)
-        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-        shutil.copy2(abs_path, dest_path)
-        logging.info(f"Copied file {abs_path} to {dest_path}")
+        if not is_up_to_date(abs_path, dest_path):
+            mirror_file(abs_path, dest_path)
+            logging.info(f"Copied file {abs_path} to {dest_path}")
         copied_files.add(abs_path)
         return slugified_filename
     return None
 
 def load_mapping(file_path):
+    # load the sync manifest: {vault relative path: {dest, mtime, size, hash, output_hash, references}}
     logging.debug(f"Loading file mapping from {file_path}")
     if os.path.exists(file_path):
         with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            mapping = json.load(f)
+        if mapping.get('version') == MANIFEST_VERSION:
+            return mapping['files']
+        # older manifest (or the original flat {path: dest} mapping), keep only the destinations so
+        # removed notes are still deleted and everything else is exported again
+        files = mapping.get('files', {}) if 'version' in mapping else mapping
+        return {
+            relative_path: {'dest': entry if isinstance(entry, str) else entry['dest']}
+            for relative_path, entry in files.items()
+        }
     return {}
 
 def save_mapping(mapping, file_path):
     logging.debug(f"Saving file mapping to {file_path}")
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(mapping, f, indent=4)
+    content = json.dumps({'version': MANIFEST_VERSION, 'files': mapping}, indent=4)
+    write_if_changed(file_path, content)
 
 def slugify(title):
     logging.debug(f"Slugifying title: {title}")
@@ -92,113 +242,339 @@ def slugify(title):
     logging.debug(f"Slugified title: {slugified_title}")
     return slugified_title
 
-def transform_obsidian_links(content):
-    # transform embedded files in the markdown
-    content = re.sub(r'!\[\[(.*?)\]\]', lambda m: f'![{m.group(1).split("|")[0]}](./{slugify(m.group(1).split("|")[0]).replace(FILE_NAME_FILTER_WORD_OUT, "")})', content)
-
-    # transform links
-    content = re.sub(r'\[\[(.*?)\]\]', lambda m: f'[{m.group(1).split("|")[0]}](./{slugify(m.group(1).split("|")[0]).replace("FILE_NAME_FILTER_WORD_OUT", "")})', content)
-    
+def fix_extensions(text):
     # handle image file types !
-    if "-png" in content:
-        content = content.replace("-png", ".png")
-    if "-svg" in content:
-        content = content.replace("-svg", ".svg")
-    if "-jpg" in content:
-        content = content.replace("-jpg", ".jpg")
-    if "-jpeg" in content:
-        content = content.replace("-jpeg", ".jpeg")
-    if "-pdf" in content:
-        content = content.replace("-pdf", ".pdf")
-
-    # remove Excalidraw data section
-    content = re.sub(r'# Excalidraw Data.*', '', content, flags=re.DOTALL)
-    return content
-
-def copy_markdown_files(vault_path, wiki_path, mapping, copied_files):
+    for ext in ('png', 'svg', 'jpg', 'jpeg', 'pdf'):
+        text = text.replace(f"-{ext}", f".{ext}")
+    return text
+
+@functools.lru_cache(maxsize=None)
+def render_link(target, embed):
+    # render the inside of an Obsidian [[link]] or ![[embed]] as a markdown link (memoized per target)
+    name = target.split("|")[0]
+    slug = slugify(name)
+    if embed:
+        return fix_extensions(f'![{name}](./{slug.replace(FILE_NAME_FILTER_WORD_OUT, "")})')
+    return fix_extensions(f'[{name}](./{slug})')
+
+def heading_anchor(heading):
+    # GitHub style anchor: lowercase, punctuation dropped, spaces turned into dashes
+    return re.sub(r'[^\w\- ]', '', heading.strip().lower()).replace(' ', '-')
+
+def link_key(inner, embed):
+    return f"{'embed' if embed else 'link'}:{inner}"
+
+class LinkResolver:
+    # resolves Obsidian [[links]] and ![[embeds]] to the wiki files they are written to, matching names like Obsidian
+    def __init__(self, pages, attachments):
+        # {vault relative path: wiki file name} for the synced notes and for every non markdown file
+        self.pages = self._index(pages, strip_ext=True)
+        self.attachments = self._index(attachments, strip_ext=False)
+        self._rendered = {}
+
+    @staticmethod
+    def _index(files, strip_ext):
+        by_path = {}
+        by_name = {}
+        for relative_path, dest in sorted(files.items(), key=lambda item: (len(item[0]), item[0])):
+            key = relative_path.replace(os.sep, '/').lower()
+            if strip_ext:
+                key = os.path.splitext(key)[0]
+            by_path[key] = (relative_path, dest)
+            by_name.setdefault(key.rsplit('/', 1)[-1], []).append(key)
+        return by_path, by_name
+
+    @staticmethod
+    def _lookup(index, key):
+        by_path, by_name = index
+        if key in by_path:
+            return by_path[key]
+        for path_key in by_name.get(key.rsplit('/', 1)[-1], []):
+            if '/' not in key or path_key.endswith('/' + key):
+                return by_path[path_key]
+        return None
+
+    def resolve(self, target):
+        # return ('page' or 'attachment', vault relative path, wiki file name) for a link target, or None
+        key = target.strip().replace('\\', '/').strip('/').lower()
+        if os.path.splitext(key)[1]:
+            found = self._lookup(self.attachments, key)
+            if found:
+                return ('attachment',) + found
+        if key.endswith('.md'):
+            key = key[:-3]
+        found = self._lookup(self.pages, key)
+        return ('page',) + found if found else None
+
+    def render(self, inner, embed):
+        # render the inside of a [[link]] or ![[embed]], returning (markdown, resolution or None if broken)
+        key = link_key(inner, embed)
+        if key not in self._rendered:
+            self._rendered[key] = self._render(inner, embed)
+        return self._rendered[key]
+
+    def _render(self, inner, embed):
+        target, _, alias = inner.partition('|')
+        path, _, heading = target.partition('#')
+        label = alias or target
+        anchor = f"#{heading_anchor(heading)}" if heading else ""
+        if not path.strip():
+            # link to a heading in the same note
+            return f"[{label}]({anchor})", ('heading', '', '')
+        resolution = self.resolve(path)
+        if resolution is None:
+            return label, None
+        kind, _, dest = resolution
+        if kind == 'attachment':
+            if embed:
+                # for embeds the alias is Obsidian's display size, use the file name as alt text
+                return f"![{path}](./{dest})", resolution
+            return f"[{label}](./{dest})", resolution
+        # notes cannot be transcluded in the wiki, embeds of notes become links
+        return f"[{label}](./{os.path.splitext(dest)[0]}{anchor})", resolution
+
+def transform_obsidian_links(content, resolver=None, links=None):
+    # turn Obsidian links and embeds into markdown links, recording each resolved link in links
+    out = []
+    pos = 0
+    for match in OBSIDIAN_TOKEN_RE.finditer(content):
+        out.append(content[pos:match.start()])
+        pos = match.end()
+        embed_target, link_target, ext = match.groups()
+        if resolver is not None and (embed_target is not None or link_target is not None):
+            embed = embed_target is not None
+            inner = embed_target if embed else link_target
+            rendered, resolution = resolver.render(inner, embed)
+            if links is not None:
+                links[link_key(inner, embed)] = resolution
+        elif embed_target is not None:
+            rendered = render_link(embed_target, True)
+        elif link_target is not None:
+            rendered = render_link(link_target, False)
+        elif ext is not None:
+            rendered = f".{ext}"
+        else:
+            # remove Excalidraw data section
+            return "".join(out)
+
+        # a link label can itself contain the Excalidraw heading, the section starts there then
+        marker = rendered.find(EXCALIDRAW_MARKER)
+        if marker != -1:
+            out.append(rendered[:marker])
+            return "".join(out)
+        out.append(rendered)
+    out.append(content[pos:])
+    return "".join(out)
+
+def links_still_resolve(entry, resolver):
+    # whether every link recorded for an exported note still resolves to the same wiki file
+    if 'links' not in entry:
+        return False
+    for key, dest in entry['links'].items():
+        kind, _, inner = key.partition(':')
+        _, resolution = resolver.render(inner, kind == 'embed')
+        if (resolution[2] if resolution else None) != dest:
+            return False
+    return True
+
+def wiki_page_name(relative_path):
+    slugified_filename = slugify(os.path.splitext(relative_path)[0]) + '.md'
+    return slugified_filename.replace("FILE_NAME_FILTER_WORD_OUT", "")
+
+def attachment_name(relative_path):
+    return slugify(os.path.splitext(relative_path)[0]) + os.path.splitext(relative_path)[1]
+
+def export_markdown_file(note, relative_path, stat, wiki_path, old_entry, resolver):
+    # transform a selected note, write it to the wiki if it changed and return its manifest entry
+    with metrics.span('read'):
+        content = note.read()
+    source_hash = content_hash(content)
+    links = {}
+    with metrics.span('transform'):
+        content = transform_obsidian_links(content, resolver, links)  # transform Obsidian links to wiki links
+    slugified_filename = wiki_page_name(relative_path)
+    dest_path = os.path.join(wiki_path, slugified_filename)
+    old_output_hash = old_entry.get('output_hash') if old_entry.get('dest') == slugified_filename else None
+    with metrics.span('write'):
+        output_hash, written = write_if_changed(dest_path, content, old_output_hash)
+    metrics.count('notes_exported')
+    if written:
+        metrics.count('notes_written')
+        logging.info(f"Copied {note.path} to {dest_path}")
+    return {
+        'dest': slugified_filename,
+        'mtime': stat[0],
+        'size': stat[1],
+        'hash': source_hash,
+        'output_hash': output_hash,
+        'links': {key: resolution[2] if resolution else None for key, resolution in sorted(links.items())},
+        'references': sorted({resolution[1] for resolution in links.values() if resolution and resolution[0] == 'attachment'}),
+    }
+
+# the resolver of the running sync, handed to pool workers once instead of with every job
+_link_resolver = None
+
+def _init_export_worker(resolver):
+    global _link_resolver
+    _link_resolver = resolver
+    metrics.drain()  # a forked worker starts with a copy of the parent's metrics, which are counted there already
+
+def _export_markdown_file_job(job):
+    # the worker's metrics travel back with the entry and are merged into the parent's
+    return export_markdown_file(*job, _link_resolver), metrics.drain()
+
+def copy_markdown_files(vault_path, wiki_path, mapping, copied_files, workers=1):
     new_mapping = {}
     references = set()
+    selected = []
+    attachments = {}
+    scan_start = time.perf_counter()
     for root, _, files in os.walk(vault_path):
+        # like Obsidian, files in hidden folders (.obsidian, .trash, ...) are not attachments
+        hidden = any(part.startswith('.') for part in os.path.relpath(root, vault_path).split(os.sep) if part != '.')
         for file in files:
+            if not file.endswith('.md') and not hidden:
+                relative_path = os.path.relpath(os.path.join(root, file), vault_path)
+                attachments[relative_path] = attachment_name(relative_path)
             if file.endswith('.md'):
+                metrics.count('notes_scanned')
                 file_path = os.path.join(root, file)
-                frontmatter = read_yaml_frontmatter(file_path)
+                relative_path = os.path.relpath(file_path, vault_path)
+                old_entry = mapping.get(relative_path, {})
+                stat = os.stat(file_path)
+                stat = (stat.st_mtime, stat.st_size)
+
+                # Same size and mtime as the last sync and the output is still there, the note was selected
+                # before and its frontmatter cannot have changed
+                if (old_entry.get('mtime'), old_entry.get('size')) == stat and os.path.exists(
+                        os.path.join(wiki_path, old_entry['dest'])):
+                    selected.append((file_path, relative_path, stat, old_entry, None))
+                    continue
+
+                note = MarkdownFile(file_path)
+                with metrics.span('frontmatter'):
+                    frontmatter = note.frontmatter
                 if should_copy_file(frontmatter):
                     logging.info(f"Copying {file_path}")
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    embedded_files = find_embedded_files(content)
-                    # Collect full path references
-                    file_path = os.path.join(root, file)
-                    logging.warning(f"file_path: {file_path}")
-
-                    for embedded_file in embedded_files:
-                        if file in embedded_file:
-                            references.add(file_path)
-                    content = transform_obsidian_links(content)  # transform Obsidian links to wiki links
-                    relative_path = os.path.relpath(file_path, vault_path)
-                    slugified_filename = slugify(os.path.splitext(relative_path)[0]) + '.md'
-                    slugified_filename = slugified_filename.replace("FILE_NAME_FILTER_WORD_OUT", "")
-                    dest_path = os.path.join(wiki_path, slugified_filename)
-                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                    with open(dest_path, 'w', encoding='utf-8') as f:
-                        f.write(content)
-                    logging.info(f"Copied {file_path} to {dest_path}")
-                    new_mapping[relative_path] = slugified_filename
-                    copied_files.add(file_path)
-
-    logging.debug("--------------------------------------------")
-    logging.debug(f"New mapping: {pprint.pformat(new_mapping)}")
-    logging.debug(f"references: {pprint.pformat(references)}")
-    logging.debug(f"copied_files: {pprint.pformat(copied_files)}")
-    return new_mapping, references
+                    selected.append((file_path, relative_path, stat, old_entry, note))
+    metrics.add_time('scan', time.perf_counter() - scan_start)
+    metrics.count('notes_selected', len(selected))
+    metrics.count('attachments_indexed', len(attachments))
 
-def copy_referenced_files(vault_path, wiki_path, references, copied_files):
-    logging.debug(
-        f"Copying referenced files: {pprint.pformat(vault_path)} \n"
-        f"{pprint.pformat(wiki_path)} \n {pprint.pformat(references)} \n {pprint.pformat(copied_files)}"
+    # Every selected note and attachment is known now, so links can be resolved while exporting
+    resolver = LinkResolver(
+        {relative_path: wiki_page_name(relative_path) for _, relative_path, _, _, _ in selected}, attachments
     )
-    for ref in references:
-        if "static" not in ref:
-            abs_path = os.path.join(vault_path, ref)
-
-        abs_path = abs_path.replace("/", "\\")
-
-        logging.info(f"abs_path: {abs_path}")
-        if os.path.exists(abs_path):
-            logging.warning(f"Referenced file {abs_path} exists!!!!")
-            slugified_filename = slugify(os.path.splitext(ref)[0]).replace("FILE_NAME_FILTER_WORD_OUT", "") + os.path.splitext(ref)[1]
-            dest_path = os.path.join(wiki_path, slugified_filename)
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-            shutil.copy2(abs_path, dest_path)
-            logging.info(f"Copied referenced file {abs_path} to {dest_path}")
-            copied_files.add(abs_path)
+    entries = {}
+    jobs = []
+    for file_path, relative_path, stat, old_entry, note in selected:
+        if note is None and links_still_resolve(old_entry, resolver):
+            entries[file_path] = old_entry
         else:
-            logging.warning(f"Referenced file {abs_path} does not exist")
+            jobs.append((note or MarkdownFile(file_path), relative_path, stat, wiki_path, old_entry))
+    logging.info(f"{len(selected) - len(jobs)} of {len(selected)} selected markdown files unchanged since the last sync")
+    metrics.count('notes_unchanged', len(selected) - len(jobs))
 
-def update_links(wiki_path):
-    for root, _, files in os.walk(wiki_path):
-        for file in files:
-            if file.endswith('.md'):
-                file_path = os.path.join(root, file)
-                logging.debug(f"Updating links in file: {file_path}")
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                content = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', lambda m: f"[{m.group(1)}]({m.group(2)})" if not m.group(2).startswith('http') else m.group(0), content)
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                logging.info(f"Updated links in {file_path}")
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_export_worker, initargs=(resolver,)) as executor:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            exported = []
+            for entry, worker_metrics in executor.map(_export_markdown_file_job, jobs, chunksize=chunksize):
+                exported.append(entry)
+                metrics.merge(worker_metrics)
+    else:
+        exported = [export_markdown_file(*job, resolver) for job in jobs]
+    entries.update((job[0].path, entry) for job, entry in zip(jobs, exported))
+
+    # merge in walk order so the result does not depend on which worker finished first
+    broken = 0
+    for file_path, relative_path, _, _, _ in selected:
+        entry = entries[file_path]
+        new_mapping[relative_path] = entry
+        references.update(entry['references'])
+        copied_files.add(file_path)
+        broken_links = [key.partition(':')[2] for key, dest in entry['links'].items() if dest is None]
+        if broken_links:
+            logging.warning(f"Broken links in {relative_path}: {', '.join(broken_links)}")
+            broken += len(broken_links)
+    if broken:
+        metrics.count('broken_links', broken)
+        logging.warning(f"{broken} links point at files that are not synced, they were written as plain text")
+
+    # pformat of the whole mapping is slow on a big vault, only do it when it will be logged
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("--------------------------------------------")
+        logging.debug(f"New mapping: {pprint.pformat(new_mapping)}")
+        logging.debug(f"references: {pprint.pformat(references)}")
+        logging.debug(f"copied_files: {pprint.pformat(copied_files)}")
+    return new_mapping, references
+
+def copy_if_changed(abs_path, dest_path):
+    if is_up_to_date(abs_path, dest_path):
+        metrics.count('files_unchanged')
+        metrics.count('bytes_unchanged', os.path.getsize(dest_path))
+        return False
+    with metrics.span('copy'):
+        method = mirror_file(abs_path, dest_path)
+    # files_copied/bytes_copied, files_reflink/bytes_reflink, files_hardlink/bytes_hardlink
+    method = 'copied' if method == 'copy' else method
+    metrics.count(f'files_{method}')
+    metrics.count(f'bytes_{method}', os.path.getsize(dest_path))
+    return True
+
+def log_mirror_summary():
+    counters = metrics.counters
+    avoided = counters['bytes_unchanged'] + counters['bytes_reflink'] + counters['bytes_hardlink']
+    logging.info(
+        f"Attachments: {counters['files_copied']} copied ({counters['bytes_copied'] / 1e6:.1f} MB), "
+        f"{counters['files_reflink']} reflinked, {counters['files_hardlink']} hard linked, "
+        f"{counters['files_unchanged']} unchanged; {avoided / 1e6:.1f} MB of copying avoided"
+    )
+    metrics.count('bytes_avoided', avoided)
+
+def copy_many(copies, workers=1):
+    # copy (abs_path, dest_path) pairs, on a thread pool when workers > 1, returns which were copied
+    if workers > 1 and len(copies) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda copy: copy_if_changed(*copy), copies))
+    return [copy_if_changed(abs_path, dest_path) for abs_path, dest_path in copies]
+
+def copy_referenced_files(vault_path, wiki_path, references, copied_files, workers=1):
+    # copy the attachments embedded or linked by the synced notes (vault relative paths) into the wiki
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Copying referenced files: {pprint.pformat(references)}")
+    copies = []
+    for ref in sorted(references):
+        abs_path = os.path.join(vault_path, ref)
+        copies.append((abs_path, os.path.join(wiki_path, attachment_name(ref))))
+        copied_files.add(abs_path)
+
+    for (abs_path, dest_path), copied in zip(copies, copy_many(copies, workers)):
+        if copied:
+            logging.info(f"Copied referenced file {abs_path} to {dest_path}")
 
 def delete_removed_files(old_mapping, new_mapping, wiki_path):
     for relative_path in old_mapping:
         if relative_path not in new_mapping:
-            file_path = os.path.join(wiki_path, old_mapping[relative_path])
+            file_path = os.path.join(wiki_path, old_mapping[relative_path]['dest'])
             if os.path.exists(file_path):
                 os.remove(file_path)
+                metrics.count('files_deleted')
                 logging.info(f"Deleted {file_path} as it no longer exists in the vault")
 
-def copy_static_files(vault_path, wiki_path, copied_files):
+    # attachments that no synced note references any more
+    old_references = {ref for entry in old_mapping.values() for ref in entry.get('references', [])}
+    new_references = {ref for entry in new_mapping.values() for ref in entry.get('references', [])}
+    for ref in old_references - new_references:
+        file_path = os.path.join(wiki_path, attachment_name(ref))
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            metrics.count('files_deleted')
+            logging.info(f"Deleted {file_path} as it is no longer referenced")
+
+def copy_static_files(vault_path, wiki_path, copied_files, workers=1):
     static_path = os.path.join(vault_path, 'static')
+    copies = []
     if os.path.exists(static_path):
         for root, _, files in os.walk(static_path):
             for file in files:
@@ -209,21 +585,49 @@ def copy_static_files(vault_path, wiki_path, copied_files):
                 if abs_path not in copied_files and not_script and not_downloaded and not_korean:
                     rel_path = os.path.relpath(abs_path, static_path)
                     dest_path = os.path.join(wiki_path, rel_path)
-                    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                    shutil.copy2(abs_path, dest_path)
-                    logging.info(f"Copied static file {abs_path} to {dest_path}")
+                    copies.append((abs_path, dest_path))
                     copied_files.add(abs_path)
 
+    for (abs_path, dest_path), copied in zip(copies, copy_many(copies, workers)):
+        if copied:
+            logging.info(f"Copied static file {abs_path} to {dest_path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync tagged Obsidian notes into the GitHub wiki.")
+    parser.add_argument('--workers', type=int, default=SYNC_WORKERS,
+                        help="processes for exporting notes and threads for copying files (1 = serial)")
+    parser.add_argument('--mirror-static', action='store_true',
+                        help="also copy everything under the vault's static folder, not just referenced attachments")
+    parser.add_argument('--asset-mode', choices=ASSET_MIRROR_MODES, default=ASSET_MIRROR_MODE,
+                        help="how attachments are mirrored into the wiki: full copies, copy-on-write reflinks or hard links")
+    parser.add_argument('--report', default=RUN_REPORT_PATH,
+                        help="where to write the JSON run report with timings and counters")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="write cProfile stats of the run to PATH, export worker processes are not included")
+    return parser.parse_args()
+
 def main():
-    old_mapping = load_mapping(MAPPING_FILE_PATH)
-    copied_files = set()
-    new_mapping, references = copy_markdown_files(OBSIDIAN_VAULT_PATH, GITHUB_WIKI_PATH, old_mapping, copied_files)
-    copy_referenced_files(OBSIDIAN_VAULT_PATH, GITHUB_WIKI_PATH, references, copied_files)
-    update_links(GITHUB_WIKI_PATH)
-    delete_removed_files(old_mapping, new_mapping, GITHUB_WIKI_PATH)
-    copy_static_files(OBSIDIAN_VAULT_PATH, GITHUB_WIKI_PATH, copied_files)
-    save_mapping(new_mapping, MAPPING_FILE_PATH)
-    logging.info("All files copied, links updated, and old files deleted.")
+    global ASSET_MIRROR_MODE
+    args = parse_args()
+    ASSET_MIRROR_MODE = args.asset_mode
+    with profiled(args.profile):
+        old_mapping = load_mapping(MAPPING_FILE_PATH)
+        copied_files = set()
+        new_mapping, references = copy_markdown_files(OBSIDIAN_VAULT_PATH, GITHUB_WIKI_PATH, old_mapping, copied_files,
+                                                      workers=args.workers)
+        with metrics.span('copy_referenced'):
+            copy_referenced_files(OBSIDIAN_VAULT_PATH, GITHUB_WIKI_PATH, references, copied_files, workers=args.workers)
+        delete_removed_files(old_mapping, new_mapping, GITHUB_WIKI_PATH)
+        if args.mirror_static:
+            with metrics.span('copy_static'):
+                copy_static_files(OBSIDIAN_VAULT_PATH, GITHUB_WIKI_PATH, copied_files, workers=args.workers)
+        save_mapping(new_mapping, MAPPING_FILE_PATH)
+    log_mirror_summary()
+    logging.info("All files copied and old files deleted.")
+
+    if args.report:
+        report = metrics.write_report(args.report, script='sync_reporty_wiki', args=vars(args))
+        logging.info(f"Run report written to {args.report} ({report['wall_seconds']}s)")
 
 if __name__ == "__main__":
     main()